@@ -44,6 +44,8 @@ module_names = [
     "panels_image",
     "utils",
     "api",
+    "codec",
+    "cache",
     "preferences",
 ]
 modules: dict
@@ -1,79 +1,844 @@
+import re
+import os
+import json
+import hashlib
+import binascii
+import base64
+import time
+import contextlib
+import threading
+import concurrent.futures
 import requests
+import requests.adapters
+import urllib3.util
+import bpy
 from . import preferences
+from . import utils
+
+
+# (connect, read) timeouts in seconds, matched by endpoint prefix
+# generation requests may legitimately run for minutes, so only connecting is bounded
+_timeouts = [
+    ("sdapi/v1/txt2img", (5, None)),
+    ("sdapi/v1/img2img", (5, None)),
+    ("sdapi/v1/progress", (2, 5)),
+    ("sdapi/v1/interrupt", (2, 10)),
+]
+_default_timeout = (5, 30)
+
+_session: requests.Session = None
+_session_lock = threading.Lock()
+
+
+def _session_get() -> requests.Session:
+    """ shared keep-alive session, urllib3 pools are thread-safe """
+    global _session
+    with _session_lock:
+        if not _session:
+            # only connection failures are retried for POST,
+            # a generation request is never sent twice
+            retry = urllib3.util.Retry(
+                total=3,
+                connect=3,
+                read=2,
+                status=2,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset({"GET"}),
+                raise_on_status=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=retry,
+            )
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def close():
+    global _session
+    with _session_lock:
+        if _session:
+            _session.close()
+            _session = None
 
 
 def _api_url():
     return preferences.get().url.strip("/")
 
 
-def get(url: str):
-    return requests.get(f"{_api_url()}/{url.strip('/')}")
-
-
-def post(url: str, json=None):
-    return requests.post(f"{_api_url()}/{url.strip('/')}", json=json)
+def _request(method: str, url: str, *, backend: "Backend" = None, **k):
+    url = url.strip('/')
+    base = backend.url if backend else _api_url()
+    return _session_get().request(
+        method,
+        f"{base}/{url}",
+        timeout=k.pop("timeout", None) or next(
+            (t for p, t in _timeouts if url.startswith(p)),
+            _default_timeout,
+        ),
+        **k,
+    )
+
+
+class Base64:
+    """ bytes sent as a base64 string by `JSONStream` """
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class JSONStream:
+    """
+    json request body produced while it is sent,
+    `Base64` values are encoded chunk by chunk so no full copy is ever held
+
+    iterating again restarts the body, so retries can resend it
+    """
+    chunk_size = 3 << 16  # multiple of 3 so chunks encode without padding
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def _parts(self, obj):
+        if isinstance(obj, Base64):
+            yield b'"'
+            view = memoryview(obj.data)
+            for i in range(0, len(view), self.chunk_size):
+                yield base64.b64encode(view[i:i + self.chunk_size])
+            yield b'"'
+        elif isinstance(obj, dict):
+            yield b"{"
+            for i, (k, v) in enumerate(obj.items()):
+                if i:
+                    yield b","
+                yield json.dumps(str(k)).encode() + b":"
+                yield from self._parts(v)
+            yield b"}"
+        elif isinstance(obj, (list, tuple)):
+            yield b"["
+            for i, v in enumerate(obj):
+                if i:
+                    yield b","
+                yield from self._parts(v)
+            yield b"]"
+        else:
+            yield json.dumps(obj).encode()
+
+    def __iter__(self):
+        buf = bytearray()
+        for x in self._parts(self.obj):
+            buf += x
+            if len(buf) >= self.chunk_size:
+                yield bytes(buf)
+                buf.clear()
+        if buf:
+            yield bytes(buf)
+
+
+def get(url: str, **k):
+    return _request("GET", url, **k)
+
+
+def post(url: str, json=None, **k):
+    if isinstance(json, JSONStream):
+        return _request(
+            "POST", url,
+            data=json,
+            headers={"Content-Type": "application/json"},
+            **k,
+        )
+    return _request("POST", url, json=json, **k)
+
+
+class BackendError(Exception):
+    pass
+
+
+class Backend:
+    """ one webui instance, jobs on it are serialized by `lock` """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.healthy = True
+        self.latency: float = None
+        self.progress = 0.0
+
+    @property
+    def busy(self):
+        return self.lock.locked()
+
+    def check(self) -> bool:
+        """ whether the backend just came back online """
+        t = time.perf_counter()
+        try:
+            get(
+                "/sdapi/v1/progress",
+                params={"skip_current_image": "true"},
+                backend=self,
+            ).raise_for_status()
+        except requests.RequestException:
+            self.healthy = False
+            return False
+        t = time.perf_counter() - t
+        self.latency = t if self.latency is None else self.latency * 0.7 + t * 0.3
+        recovered = not self.healthy
+        self.healthy = True
+        return recovered
+
+
+_backends: dict[str, Backend] = {}
+_pool_lock = threading.Lock()
+
+
+def sync_backends():
+    """ mirror the urls in preferences, must be called from the main thread """
+    urls = preferences.get().backend_urls()
+    with _pool_lock:
+        old = dict(_backends)
+        _backends.clear()
+        for url in urls:
+            _backends[url] = old.get(url) or Backend(url)
+    threading.Thread(target=check_backends, daemon=True).start()
+
+
+def backend(url: str) -> Backend:
+    return _backends.get(url.strip("/"))
+
+
+def backends() -> list[Backend]:
+    with _pool_lock:
+        return list(_backends.values())
+
+
+def check_backends() -> bool:
+    """ whether one of the backends just came back online """
+    pool = backends()
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(pool))) as e:
+        return any(list(e.map(Backend.check, pool)))
+
+
+def loaded_models(urls: list[str]) -> dict[str, str]:
+    """
+    checkpoint loaded on each healthy backend of `urls`,
+    None if one of them cannot tell or none is healthy
+
+    asked once without retries, a slow backend only skips the cache
+    """
+    pool = [b for b in map(backend, urls) if b and b.healthy]
+    if not pool:
+        return None
+
+    def model(b):
+        # outside the session, its retries would stall the request
+        r = requests.get(f"{b.url}/sdapi/v1/options", timeout=(1, 5))
+        return b.url, r.json()["sd_model_checkpoint"]
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(len(pool)) as e:
+            return dict(e.map(model, pool))
+    except (requests.RequestException, ValueError, KeyError, TypeError):
+        return None
+
+
+@contextlib.contextmanager
+def acquire(cancel: threading.Event = None):
+    """ hold the least loaded healthy backend, gives None once `cancel` is set while waiting """
+    with _pool_lock:
+        pool = list(_backends.values())
+        b = min(
+            [x for x in pool if x.healthy] or pool,
+            key=lambda x: (
+                x.pending,
+                x.latency if x.latency is not None else float("inf"),
+            ),
+        )
+        b.pending += 1
+    try:
+        while not b.lock.acquire(timeout=0.1):
+            if cancel and cancel.is_set():
+                yield None
+                return
+        try:
+            b.progress = 0.0
+            yield b
+        finally:
+            b.lock.release()
+    finally:
+        with _pool_lock:
+            b.pending -= 1
+
+
+class ProgressPoller(threading.Thread):
+    """
+    polls the busy backends in the background,
+    `state` is `(progress, eta, text)` and safe to read from any thread
+
+    with `on_preview`, the in-progress image of one backend is fetched at
+    most every `preview_interval` seconds and passed to it on this thread
+
+    with `job`, only the backends running its parts are polled
+    """
+
+    def __init__(self, interval=0.5, *, on_preview=None, preview_interval=1.0, job=None):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.job = job
+        self.on_preview = on_preview
+        self.preview_interval = preview_interval
+        self.stop = threading.Event()
+        self._lock = threading.Lock()
+        self._state = (0.0, None, "")
+        self._preview_time = 0.0
+
+    @property
+    def state(self) -> tuple[float, float, str]:
+        with self._lock:
+            return self._state
+
+    def poll(self, b: Backend, preview=False) -> dict:
+        try:
+            r = get(
+                "/sdapi/v1/progress",
+                params={"skip_current_image": "false" if preview else "true"},
+                backend=b,
+            ).json()
+        except (requests.RequestException, ValueError):
+            return None  # keep the last value
+        b.progress = r["progress"]
+        if preview and r.get("current_image"):
+            self.on_preview(base64.b64decode(r["current_image"]))
+        return r
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            if self.job:
+                busy = [x for x in list(self.job.parts) if isinstance(x, Backend)]
+            else:
+                busy = [x for x in backends() if x.busy]
+            if not busy:
+                continue
+            now = time.monotonic()
+            preview = (
+                self.on_preview is not None
+                and now - self._preview_time >= self.preview_interval
+            )
+            if preview:
+                self._preview_time = now
+            polls = [
+                x for x in (
+                    self.poll(b, preview and i == 0)
+                    for i, b in enumerate(busy)
+                ) if x
+            ]
+            eta = max((x["eta_relative"] for x in polls), default=None)
+            steps = [
+                f"{x['state']['sampling_step']}/{x['state']['sampling_steps']}"
+                for x in polls if x["state"].get("sampling_steps")
+            ]
+            text = " ".join(steps)
+            if eta:
+                text += f" ETA {eta:.0f}s"
+            with self._lock:
+                self._state = (
+                    sum(x.progress for x in busy) / len(busy),
+                    eta,
+                    text,
+                )
+
+
+_info_lists = [
+    "all_prompts", "all_negative_prompts",
+    "all_seeds", "all_subseeds", "infotexts",
+]
+
+
+def _split(req: dict, n: int) -> list[dict]:
+    """
+    split `n_iter` into `n` requests with the seeds the backend
+    would have used for the same images in a single request
+    """
+    n_iter = req.get("n_iter", 1)
+    batch_size = req.get("batch_size", 1)
+    n = max(1, min(n, n_iter))
+    parts = []
+    start = 0
+    for i in range(n):
+        count = n_iter // n + (i < n_iter % n)
+        part = dict(req, n_iter=count)
+        offset = start * batch_size
+        if int(req.get("seed", -1)) != -1 and not req.get("subseed_strength"):
+            part["seed"] = str(int(req["seed"]) + offset)
+        if int(req.get("subseed", -1)) != -1:
+            part["subseed"] = str(int(req["subseed"]) + offset)
+        parts.append(part)
+        start += count
+    return parts
+
+
+class _JSONReader:
+    """
+    pull parser over a chunked json body, just enough to walk the
+    top-level object of a response without holding all of it
+    """
+    _ws = re.compile(rb"[ \t\r\n]*")
+    _structure = re.compile(rb'["{}\[\]]')
+    _scalar_end = re.compile(rb"[,}\] \t\r\n]")
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = b""
+        self.pos = 0
+
+    def _fill(self):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            raise ValueError("truncated json response")
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> bytes:
+        while True:
+            self.pos = self._ws.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, c: bytes):
+        if self.peek() != c:
+            raise ValueError(f"expected {c} in json response")
+        self.pos += 1
+
+    def skip(self, c: bytes):
+        if self.peek() == c:
+            self.pos += 1
+
+    def string(self):
+        """ yield the raw, still escaped content of the next string in pieces """
+        self.expect(b'"')
+        start = self.pos
+        while True:
+            i = self.buf.find(b'"', start)
+            if i == -1:
+                # hold back trailing backslashes, they may escape the next byte
+                end = len(self.buf)
+                while end > self.pos and self.buf[end - 1] == 0x5c:
+                    end -= 1
+                if end > self.pos:
+                    yield self.buf[self.pos:end]
+                    self.pos = end
+                self._fill()
+                start = self.pos
+                continue
+            j = i
+            while j > self.pos and self.buf[j - 1] == 0x5c:
+                j -= 1
+            if (i - j) % 2:
+                start = i + 1
+                continue
+            if i > self.pos:
+                yield self.buf[self.pos:i]
+            self.pos = i + 1
+            return
+
+    def value(self, *, keep=True) -> bytes:
+        """ the raw json text of the next value, discarded unless `keep` """
+        out = []
+        c = self.peek()
+        if c == b'"':
+            s = b"".join(self.string())
+            return b'"' + s + b'"' if keep else None
+        if c in (b"{", b"["):
+            depth = 0
+            while True:
+                m = self._structure.search(self.buf, self.pos)
+                if not m:
+                    if keep:
+                        out.append(self.buf[self.pos:])
+                    self.pos = len(self.buf)
+                    self._fill()
+                    continue
+                i = m.start()
+                if keep:
+                    out.append(self.buf[self.pos:i])
+                self.pos = i
+                if self.buf[i] == 0x22:
+                    s = b"".join(self.string())
+                    if keep:
+                        out.append(b'"' + s + b'"')
+                    continue
+                if keep:
+                    out.append(self.buf[i:i + 1])
+                self.pos = i + 1
+                depth += 1 if self.buf[i] in b"{[" else -1
+                if depth == 0:
+                    return b"".join(out) if keep else None
+        while True:
+            m = self._scalar_end.search(self.buf, self.pos)
+            if m:
+                v = self.buf[self.pos:m.start()]
+                self.pos = m.start()
+                return v if keep else None
+            self._fill()
+
+
+def _read_response(chunks, on_image) -> dict:
+    """
+    parse a generation response in one pass, each image is base64 decoded
+    while it arrives and passed to `on_image` before the next one is read
+
+    returns the remaining top-level fields, the echoed `parameters` are skipped
+    """
+    r = _JSONReader(chunks)
+    out = {}
+    r.expect(b"{")
+    while r.peek() != b"}":
+        key = json.loads(b'"' + b"".join(r.string()) + b'"')
+        r.expect(b":")
+        if key == "images" and r.peek() == b"[":
+            r.expect(b"[")
+            while r.peek() != b"]":
+                data = []
+                carry = b""
+                for piece in r.string():
+                    piece = carry + piece.replace(b"\\/", b"/")
+                    n = len(piece) // 4 * 4
+                    data.append(binascii.a2b_base64(piece[:n]))
+                    carry = piece[n:]
+                if carry:
+                    data.append(binascii.a2b_base64(carry))
+                on_image(b"".join(data))
+                r.skip(b",")
+            r.expect(b"]")
+        elif key == "parameters":
+            r.value(keep=False)
+        else:
+            out[key] = json.loads(r.value())
+        r.skip(b",")
+    return out
+
+
+def _merge(results: list[dict]) -> dict:
+    if not results:
+        return None
+    if len(results) == 1:
+        return results[0]
+    infos = [json.loads(x["info"]) for x in results]
+    info = dict(infos[0])
+    for k in _info_lists:
+        info[k] = [y for x in infos for y in x.get(k, [])]
+    return {
+        "info": json.dumps(info),
+    }
+
+
+class Job:
+    """ progress of one `generate` call, safe to read from any thread """
+
+    def __init__(self):
+        # per part: None while queued, its backend while running, True when done
+        self.parts: list = []
+
+    @property
+    def started(self) -> bool:
+        return any(x is not None for x in self.parts)
+
+    @property
+    def progress(self) -> float:
+        parts = list(self.parts)
+        if not parts:
+            return 0.0
+        return sum(
+            1.0 if x is True else x.progress if x else 0.0
+            for x in parts
+        ) / len(parts)
+
+
+def interrupt(job: Job):
+    """ stop the running parts of `job`, other jobs on the same backends keep going """
+    for b in list(job.parts):
+        if isinstance(b, Backend):
+            try:
+                post("/sdapi/v1/interrupt", backend=b)
+            except requests.RequestException:
+                pass
+
+
+def generate(
+    url: str, req: dict, *,
+    cancel: threading.Event = None,
+    on_image=None,
+    job: Job = None,
+) -> dict:
+    """
+    run a generation request on the backend pool,
+    the batch count is split across backends and merged back in order
+
+    `on_image(index, data)` receives the images one by one in order while
+    the responses stream in, without it they are returned in `images`
+
+    the backend progress in `job` is only updated while a `ProgressPoller` runs
+    """
+    parts = _split(req, len([x for x in backends() if x.healthy]))
+    job = job or Job()
+    job.parts = [None] * len(parts)
+
+    images = []
+    if not on_image:
+        def on_image(_, data):
+            images.append(data)
+
+    # parts finish in any order, later ones are held back until the earlier are done
+    lock = threading.Lock()
+    held = [[] for _ in parts]
+    done = [False] * len(parts)
+    state = {"part": 0, "index": 0}
+
+    def emit(data):
+        on_image(state["index"], data)
+        state["index"] += 1
+
+    def push(part, data):
+        with lock:
+            if part == state["part"]:
+                emit(data)
+            else:
+                held[part].append(data)
+
+    def finish(part):
+        with lock:
+            done[part] = True
+            while state["part"] < len(parts) and done[state["part"]]:
+                state["part"] += 1
+                if state["part"] < len(parts):
+                    for x in held[state["part"]]:
+                        emit(x)
+                    held[state["part"]].clear()
+
+    def run(i):
+        try:
+            with acquire(cancel) as b:
+                if not b:
+                    return None
+                # recorded before the check so `interrupt` cannot miss it
+                job.parts[i] = b
+                if cancel and cancel.is_set():
+                    return None
+                r = post(url, json=JSONStream(parts[i]), backend=b, stream=True)
+                with r:
+                    if r.status_code != 200:
+                        raise BackendError(f"{b.url}: {r.text}")
+                    return _read_response(
+                        r.iter_content(1 << 16),
+                        lambda data: push(i, data),
+                    )
+        finally:
+            job.parts[i] = True
+            finish(i)
+
+    with concurrent.futures.ThreadPoolExecutor(len(parts)) as e:
+        results = list(e.map(run, range(len(parts))))
+    result = _merge([x for x in results if x])
+    if result is not None and images:
+        result["images"] = images
+    return result
+
+
+# every enum is derived from one of these endpoints, fetched once per refresh
+_enum_sources = {
+    "sdapi/v1/samplers": lambda r: [x["name"] for x in r],
+    "sdapi/v1/upscalers": lambda r: [x["name"] for x in r],
+    "controlnet/module_list": lambda r: list(r["module_list"]),
+    "controlnet/model_list": lambda r: list(r["model_list"]),
+}
+_enum_ttl = 24 * 60 * 60  # seconds before the values on disk are refreshed
+
+_enum_lock = threading.Lock()
+_enum_url: str = None  # backend the values below belong to
+_enum_values: dict[str, list[str]] = {}
+_enum_items: dict[str, list[tuple[str, str, str]]] = {}
+_enum_refreshing = False
+_enum_version = 0  # bumped whenever the values above change
+# set off the main thread, handled by `_enum_timer`
+_enum_retry = threading.Event()
+_enum_redraw = threading.Event()
+
+
+def enum_version() -> int:
+    """ the enum items only change along with this, readers can skip the callbacks until then """
+    return _enum_version
+
+
+def _enum_cache_path(url: str) -> str:
+    name = hashlib.sha1(url.encode()).hexdigest()[:16]
+    return os.path.join(utils.cache_dir("enums"), f"{name}.json")
+
+
+def _load_enum_cache(path: str) -> tuple[float, dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data["time"], data["values"]
+    except (OSError, ValueError, KeyError):
+        return 0, {}
+
+
+def _fetch_enums(url: str, path: str):
+    """ fetch every source concurrently, keeping the last known value of failed ones """
+    global _enum_refreshing, _enum_version
+    b = backend(url) or Backend(url)
+
+    def fetch(endpoint):
+        return _enum_sources[endpoint](get(endpoint, backend=b).json())
+
+    values = {}
+    with concurrent.futures.ThreadPoolExecutor(len(_enum_sources)) as pool:
+        futures = {k: pool.submit(fetch, k) for k in _enum_sources}
+        for k, f in futures.items():
+            try:
+                values[k] = f.result()
+            except Exception:
+                pass  # e.g. controlnet not installed or backend offline
+
+    with _enum_lock:
+        _enum_refreshing = False
+        if _enum_url != url or not values:
+            return
+        _enum_values.update(values)
+        _enum_items.clear()
+        _enum_version += 1
+        values = dict(_enum_values)
+    _enum_redraw.set()
+
+    try:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "time": time.time(), "values": values}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def refresh_enum_caches(*, force=False):
+    """
+    serve the last known values of the current backend right away
+    and refresh them in the background when they are missing, stale or `force`d
+    """
+    global _enum_url, _enum_refreshing, _enum_version
+    url = _api_url()
+    if not url:
+        return
+    path = _enum_cache_path(url)
+    with _enum_lock:
+        if url != _enum_url:
+            saved, values = _load_enum_cache(path)
+            _enum_url = url
+            _enum_values.clear()
+            _enum_values.update(values)
+            _enum_items.clear()
+            _enum_version += 1
+        else:
+            saved, _ = _load_enum_cache(path)
+        if _enum_refreshing:
+            return
+        if not force and time.time() - saved < _enum_ttl:
+            return
+        _enum_refreshing = True
+    threading.Thread(target=_fetch_enums, args=(url, path), daemon=True).start()
 
 
-_enum_caches = {}
+def clear_enum_caches():
+    with contextlib.suppress(OSError):
+        if _enum_url:
+            os.remove(_enum_cache_path(_enum_url))
+    refresh_enum_caches(force=True)
 
 
-def clear_enum_caches():
-    _enum_caches.clear()
+# blender needs at least one item, this one is never stored
+_enum_unavailable = [("", "Unavailable", "")]
 
 
-def _enum_wrapper(s, f):
+def _enum_wrapper(name: str, endpoint: str, extra: tuple[str, ...] = ()):
+    """
+    items callback that never blocks on the network,
+    the returned list stays the same object until the values change
+    """
     def fn(self, context):
-        if not _enum_caches.get(s):
-            _enum_caches[s] = f()
-        return [(x, x, "") for x in _enum_caches[s]]
+        if items := _enum_items.get(name):
+            return items
+        with _enum_lock:
+            values = [*extra, *_enum_values.get(endpoint, ())]
+            if not values:
+                return _enum_unavailable
+            items = _enum_items[name] = [(x, x, "") for x in values]
+        return items
     return fn
 
 
-def _samplers_get():
-    r = get("/sdapi/v1/samplers")
-    return list((x["name"] for x in r.json()))
-
+Samplers = _enum_wrapper("samplers", "sdapi/v1/samplers")
 
-Samplers = _enum_wrapper("_samplers", _samplers_get)
+Upscalers = _enum_wrapper("upscalers", "sdapi/v1/upscalers")
 
+HiResUpscalers = _enum_wrapper("hr_upscalers", "sdapi/v1/upscalers", (
+    "Latent",
+    "Latent (antialiased)",
+    "Latent (bicubic)",
+    "Latent (bicubic antialiased)",
+    "Latent (nearest)",
+    "Latent (nearest-exact)",
+))
 
-def _upscalers_get():
-    r = get("/sdapi/v1/upscalers")
-    return list((x["name"] for x in r.json()))
+CNetModules = _enum_wrapper("cnet_modules", "controlnet/module_list")
 
+CNetModels = _enum_wrapper("cnet_models", "controlnet/model_list")
 
-Upscalers = _enum_wrapper("_upscalers", _upscalers_get)
 
-
-def _hr_upscalers_get():
-    r = get("/sdapi/v1/upscalers")
-    return [
-        *(
-            "Latent",
-            "Latent (antialiased)",
-            "Latent (bicubic)",
-            "Latent (bicubic antialiased)",
-            "Latent (nearest)",
-            "Latent (nearest-exact)",
-        ),
-        *(x["name"] for x in r.json())
-    ]
+def _enum_timer():
+    """
+    refetch the enums once a backend is reachable again or while
+    none are known, and redraw after new ones arrived
+    """
+    if _enum_retry.is_set():
+        _enum_retry.clear()
+        refresh_enum_caches(force=True)
+    if _enum_redraw.is_set():
+        _enum_redraw.clear()
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                area.tag_redraw()
+    return 1.0
 
 
-HiResUpscalers = _enum_wrapper("_hr_upscalers", _hr_upscalers_get)
+class _HealthChecker(threading.Thread):
+    interval = 10
 
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stop = threading.Event()
 
-def _cnet_modules_get():
-    r = get("/controlnet/module_list")
-    return list(r.json()["module_list"])
+    def run(self):
+        while not self.stop.wait(self.interval):
+            if check_backends() or not _enum_values:
+                _enum_retry.set()
 
 
-CNetModules = _enum_wrapper("_cnet_modules", _cnet_modules_get)
+_health_checker: _HealthChecker = None
 
 
-def _cnet_models_get():
-    r = get("/controlnet/model_list")
-    return list(r.json()["model_list"])
+def register():
+    global _health_checker
+    _health_checker = _HealthChecker()
+    _health_checker.start()
+    bpy.app.timers.register(_enum_timer, first_interval=1.0, persistent=True)
 
 
-CNetModels = _enum_wrapper("_cnet_models", _cnet_models_get)
+def unregister():
+    if bpy.app.timers.is_registered(_enum_timer):
+        bpy.app.timers.unregister(_enum_timer)
+    _health_checker.stop.set()
+    close()
@@ -0,0 +1,84 @@
+import os
+import json
+import shutil
+import hashlib
+from . import utils
+
+
+def directory() -> str:
+    """ call on the main thread and hand the path to the workers """
+    return utils.cache_dir("results")
+
+
+def key(obj) -> str:
+    """ sha256 of the canonical json of `obj` """
+    return hashlib.sha256(json.dumps(
+        obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    ).encode()).hexdigest()
+
+
+def load(root: str, k: str) -> tuple[list[bytes], str]:
+    """ (images, info) of an entry and mark it as recently used, None on a miss """
+    path = os.path.join(root, k)
+    try:
+        with open(os.path.join(path, "info.json"), encoding="utf-8") as f:
+            entry = json.load(f)
+        images = []
+        for i in range(entry["count"]):
+            with open(os.path.join(path, f"{i}.png"), "rb") as f:
+                images.append(f.read())
+        os.utime(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    return images, entry["info"]
+
+
+def store(root: str, k: str, images: list[bytes], info: str, limit: int):
+    """ add an entry, then evict the least recently used ones above `limit` bytes """
+    path = os.path.join(root, k)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp, exist_ok=True)
+        for i, data in enumerate(images):
+            with open(os.path.join(tmp, f"{i}.png"), "wb") as f:
+                f.write(data)
+        # written last, an entry without it is never read
+        with open(os.path.join(tmp, "info.json"), "w", encoding="utf-8") as f:
+            json.dump({"count": len(images), "info": info}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    evict(root, limit)
+
+
+def _entries(root: str) -> list[tuple[float, int, str]]:
+    """ (last use, size, path) of every entry """
+    entries = []
+    with os.scandir(root) as it:
+        for e in it:
+            if not e.is_dir() or e.name.endswith(".tmp"):
+                continue
+            with os.scandir(e.path) as files:
+                size = sum(x.stat().st_size for x in files)
+            entries.append((e.stat().st_mtime, size, e.path))
+    return entries
+
+
+def evict(root: str, limit: int):
+    try:
+        entries = sorted(_entries(root))
+    except OSError:
+        return
+    total = sum(x[1] for x in entries)
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def clear(root: str):
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root, exist_ok=True)
@@ -0,0 +1,120 @@
+import io
+import zlib
+import struct
+import numpy
+
+try:
+    from PIL import Image as _pil
+except ImportError:
+    _pil = None  # optional, only for jpeg and webp
+
+# codecs `encode` can write, blender does not bundle pillow
+codecs = ("PNG", "JPEG", "WEBP") if _pil else ("PNG",)
+
+
+def _chunk(ty: bytes, data: bytes) -> bytes:
+    return b"".join([
+        struct.pack(">I", len(data)),
+        ty,
+        data,
+        struct.pack(">I", zlib.crc32(ty + data)),
+    ])
+
+
+def encode_png(pixels: numpy.ndarray, *, bits=16, level=6) -> bytes:
+    """
+    encode float pixels in [0, 1] shaped (height, width, channels),
+    top row first, with 1 (gray), 3 (rgb) or 4 (rgba) channels
+    """
+    h, w, c = pixels.shape
+    if bits == 16:
+        data = (numpy.clip(pixels, 0, 1) * 65535 + 0.5).astype(">u2")
+    else:
+        data = (numpy.clip(pixels, 0, 1) * 255 + 0.5).astype(numpy.uint8)
+    rows = data.view(numpy.uint8).reshape(h, -1)
+
+    # `up` filter on every row, cheap to vectorize and good on smooth passes
+    filtered = numpy.empty((h, rows.shape[1] + 1), dtype=numpy.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    numpy.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+
+    color_type = {1: 0, 3: 2, 4: 6}[c]
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, bits, color_type, 0, 0, 0)),
+        _chunk(b"IDAT", zlib.compress(filtered.tobytes(), level)),
+        _chunk(b"IEND", b""),
+    ])
+
+
+def png_info(data: bytes) -> tuple[int, int, int, int]:
+    """ (width, height, bit depth, color type) from the png header, None if not a png """
+    if data[:8] != b"\x89PNG\r\n\x1a\n" or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">IIBB", data[16:26])
+
+
+def extension(data: bytes) -> str:
+    """ file extension matching the encoded image, png when unknown """
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "png"
+
+
+def _box_weights(n_in: int, n_out: int) -> numpy.ndarray:
+    """ (n_out, n_in) matrix averaging the input pixels each output pixel covers """
+    edges = numpy.arange(n_out + 1) * (n_in / n_out)
+    lo = numpy.arange(n_in)
+    w = numpy.clip(
+        numpy.minimum(edges[1:, None], lo + 1) - numpy.maximum(edges[:-1, None], lo),
+        0, None,
+    )
+    return (w / w.sum(axis=1, keepdims=True)).astype(numpy.float32)
+
+
+def fit(pixels: numpy.ndarray, width: int, height: int) -> numpy.ndarray:
+    """
+    downscale with area averaging until the image just covers width x height,
+    the aspect ratio is kept and the image is never enlarged
+    """
+    h, w, c = pixels.shape
+    s = max(width / w, height / h)
+    if s >= 1:
+        return pixels
+    out_w, out_h = max(1, round(w * s)), max(1, round(h * s))
+    if w % out_w == 0 and h % out_h == 0:
+        return pixels.reshape(
+            out_h, h // out_h, out_w, w // out_w, c
+        ).mean(axis=(1, 3), dtype=numpy.float32)
+    rows = numpy.tensordot(_box_weights(h, out_h), pixels, axes=(1, 0))
+    return numpy.tensordot(rows, _box_weights(w, out_w), axes=(1, 1)).transpose(0, 2, 1)
+
+
+def gray(pixels: numpy.ndarray) -> numpy.ndarray:
+    return (pixels[..., :3] @ numpy.array(
+        [0.2126, 0.7152, 0.0722], dtype=numpy.float32
+    ))[..., None]
+
+
+def encode(
+    pixels: numpy.ndarray, *,
+    codec="PNG", bits=16, color_mode="RGB", level=6, quality=90,
+) -> bytes:
+    """
+    encode float rgb pixels, top row first
+
+    jpeg and webp need pillow, without it they fall back to png
+    """
+    if color_mode == "GRAY":
+        pixels = gray(pixels)
+    if codec == "PNG" or not _pil:
+        return encode_png(pixels, bits=bits, level=level)
+
+    data = (numpy.clip(pixels, 0, 1) * 255 + 0.5).astype(numpy.uint8)
+    img = _pil.fromarray(data[..., 0] if data.shape[2] == 1 else data)
+    buf = io.BytesIO()
+    img.save(buf, format=codec, quality=quality)
+    return buf.getvalue()
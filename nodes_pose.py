@@ -1,10 +1,40 @@
 import bpy
 import gpu
-import numpy
 from . import utils
 from . import overlays_pose
 
 
+# image name -> state it was last rendered in, see `CompositorNodeOpenPose.render`
+_render_tokens: dict[str, tuple] = {}
+
+# kept across renders, only recreated when the size or format changes
+_offscreen: list = [None, None]  # [(width, height, format), GPUOffScreen]
+_readback: list = [None, None]  # [(width, height), gpu.types.Buffer]
+
+
+def offscreen(size, fmt: str) -> gpu.types.GPUOffScreen:
+    key = (*size, fmt)
+    if _offscreen[0] != key:
+        free_offscreen()
+        _offscreen[:] = key, gpu.types.GPUOffScreen(*size, format=fmt)
+    return _offscreen[1]
+
+
+def readback(size) -> gpu.types.Buffer:
+    """ flat float rgba buffer the framebuffer is read into, in image pixel order """
+    key = tuple(size)
+    if _readback[0] != key:
+        _readback[:] = key, gpu.types.Buffer("FLOAT", size[0] * size[1] * 4)
+    return _readback[1]
+
+
+def free_offscreen():
+    if _offscreen[1]:
+        _offscreen[1].free()
+    _offscreen[:] = None, None
+    _readback[:] = None, None
+
+
 class RenderOpenPoseOverlay(utils.NodeOperator):
     bl_idname = "sd.render_openpose_overlay"
     bl_label = "Render OpenPose Overlay"
@@ -13,7 +43,7 @@ class RenderOpenPoseOverlay(utils.NodeOperator):
         if not self.node:
             return {"CANCELLED"}
 
-        self.node.render(context)
+        self.node.render(context, force=True)
 
         return {'FINISHED'}
 
@@ -38,6 +68,14 @@ class CompositorNodeOpenPose(utils.CustomCompositorNode):
     )
     overlay: utils.OpenPoseOverlayTypeProperty()
     overlay_thickness: utils.OpenPoseOverlayThicknessProperty()
+    precision: bpy.props.EnumProperty(
+        name="Precision",
+        default="BYTE",
+        items=[
+            ("BYTE", "8 Bit", "Rasterize into an 8 bit buffer, enough for the flat colors of the poses"),
+            ("FLOAT", "Float", "Rasterize into a 32 bit float buffer"),
+        ],
+    )
 
     def draw_buttons(self, context, layout):
         layout = layout.column()
@@ -47,6 +85,7 @@ class CompositorNodeOpenPose(utils.CustomCompositorNode):
             if 0 <= int(self.view_layer_index) < len(self.scene.view_layers):
                 layout.prop(self, "overlay", text="Type")
                 layout.prop(self, "overlay_thickness", text="Thickness")
+                layout.prop(self, "precision")
                 RenderOpenPoseOverlay.ui(
                     self, layout,
                     text="Render",
@@ -69,17 +108,39 @@ class CompositorNodeOpenPose(utils.CustomCompositorNode):
             output.inputs["Color"],
         )
 
-    def render(self, context: bpy.types.Context):
-        openpose_scene = overlays_pose.collect_parts(
-            self.scene,
-            self.scene.view_layers[
-                int(self.view_layer_index)
-            ]
+    def render(self, context: bpy.types.Context, *, force=False):
+        """ rasterize the poses, skipped while nothing they depend on changed """
+        view_layer = self.scene.view_layers[int(self.view_layer_index)]
+        name = f"._OpenPose_{self.scene.name}_{view_layer.name}"
+        size, mat = overlays_pose.scene_camera_info()
+        token = (
+            self.scene.frame_current,
+            self.overlay,
+            self.overlay_thickness,
+            self.precision,
+            tuple(size),
+            tuple(map(tuple, mat)),
+            tuple(
+                overlays_pose.change_token(x) for x in self.scene.objects
+                if x.type == "ARMATURE" and x.visible_get(view_layer=view_layer)
+            ),
         )
-
-        size, _ = overlays_pose.scene_camera_info()
-        offscreen = gpu.types.GPUOffScreen(*size, format="RGBA32F")
-        with offscreen.bind():
+        img_node = next(filter(
+            lambda x: x.bl_idname == "CompositorNodeImage",
+            self.node_tree.nodes
+        ))
+        if not force and _render_tokens.get(name) == token and (img := bpy.data.images.get(name)):
+            if img_node.image != img:
+                img_node.image = img
+            return
+
+        if force:
+            overlays_pose.clear_caches()
+        openpose_scene = overlays_pose.collect_parts(self.scene, view_layer)
+
+        fmt = "RGBA8" if self.precision == "BYTE" else "RGBA32F"
+        buf = readback(size)
+        with offscreen(size, fmt).bind():
             gpu_buf = gpu.state.active_framebuffer_get()
             gpu_buf.clear(color=(0.0, 0.0, 0.0, 1.0))
             overlays_pose.draw_overlay(
@@ -87,25 +148,25 @@ class CompositorNodeOpenPose(utils.CustomCompositorNode):
                 ty=self.overlay,
                 thickness=self.overlay_thickness,
             )
-
-            buf = gpu_buf.read_color(0, 0, *size, 4, 0, 'FLOAT')
-            buf = numpy.array(buf, dtype=numpy.float32).T.flat.copy()
-
-        offscreen.free()
-
-        name = f"._OpenPose_{self.scene.name}_{self.scene.view_layers[int(self.view_layer_index)].name}"
+            # rows come bottom first like image pixels, no reordering needed
+            gpu_buf.read_color(0, 0, *size, 4, 0, 'FLOAT', data=buf)
 
         img = bpy.data.images.get(name) or bpy.data.images.new(
             name, *size, is_data=True
         )
-        img.scale(*size)
-        img.pixels = buf
+        if tuple(img.size) != tuple(size):
+            img.scale(*size)
+        img.pixels.foreach_set(buf)
+        img.update()
         img.is_runtime_data = True
 
-        next(filter(
-            lambda x: x.bl_idname == "CompositorNodeImage",
-            self.node_tree.nodes
-        )).image=img
+        img_node.image = img
+        _render_tokens[name] = token
+
+
+def unregister():
+    free_offscreen()
+    _render_tokens.clear()
 
 
 classes = [
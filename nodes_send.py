@@ -2,16 +2,91 @@ import bpy
 import re
 import os
 import io
+import math
 import json
+import hashlib
 import numpy
-import tempfile
-import base64
+import requests
+import queue
 import threading
+import contextlib
+import collections
+import concurrent.futures
 from . import api
+from . import cache
+from . import codec
 from . import utils
+from . import preferences
 from . import nodes_pose
 
 
+class TransferFormatProperty(bpy.types.PropertyGroup):
+    codec: bpy.props.EnumProperty(
+        name="Codec",
+        items=[
+            ("PNG", "PNG", "Lossless"),
+            ("JPEG", "JPEG", "Lossy, needs Pillow"),
+            ("WEBP", "WebP", "Lossy, needs Pillow"),
+        ],
+    )
+    color_depth: bpy.props.EnumProperty(
+        name="Color Depth",
+        items=[
+            ("8", "8", "8 bit color channels"),
+            ("16", "16", "16 bit color channels"),
+        ],
+    )
+    color_mode: bpy.props.EnumProperty(
+        name="Color",
+        items=[
+            ("RGB", "RGB", "Color"),
+            ("GRAY", "BW", "Single grayscale channel"),
+        ],
+    )
+    compression: bpy.props.IntProperty(
+        name="Compression",
+        description="PNG compression level",
+        min=0,
+        max=9,
+        default=6,
+    )
+    quality: bpy.props.IntProperty(
+        name="Quality",
+        subtype="PERCENTAGE",
+        min=1,
+        max=100,
+        default=90,
+    )
+    fit: bpy.props.BoolProperty(
+        name="Fit",
+        description="Downscale to the generation size before encoding",
+        default=True,
+    )
+
+    def draw(self, layout, *, codecs=False):
+        # the lossy codecs are only offered where they can be encoded
+        codecs = codecs and len(codec.codecs) > 1
+        r = layout.row(align=True)
+        if codecs:
+            r.prop(self, "codec", text="")
+        if self.codec == "PNG" or not codecs:
+            r.prop(self, "color_depth", expand=True)
+            r.prop(self, "compression", text="")
+        else:
+            r.prop(self, "quality")
+        r.prop(self, "color_mode", expand=True)
+        r.prop(self, "fit", toggle=True)
+
+    def snapshot(self, *, codecs=False) -> dict:
+        return {
+            "codec": self.codec if codecs and self.codec in codec.codecs else "PNG",
+            "bits": int(self.color_depth),
+            "color_mode": self.color_mode,
+            "level": self.compression,
+            "quality": self.quality,
+        }
+
+
 class SDIMG2IMGProperty(bpy.types.PropertyGroup):
     resize_mode: bpy.props.EnumProperty(
         name="Resize Mode",
@@ -48,6 +123,7 @@ class SDIMG2IMGProperty(bpy.types.PropertyGroup):
         ],
     )
     inpaint_full_res: bpy.props.BoolProperty(name="Only Masked")
+    format: bpy.props.PointerProperty(type=TransferFormatProperty)
     inpaint_full_res_padding: utils.RoundedIntProperty(
         id="inpaint_full_res_padding",
         name="Padding",
@@ -82,6 +158,7 @@ class SDTXT2IMGProperty(bpy.types.PropertyGroup):
         sid="hr_upscaler_s",
         name="Upscaler",
         items=api.HiResUpscalers,
+        version=api.enum_version,
     )
     hr_second_pass_steps: bpy.props.IntProperty(
         name="HiRes Steps",
@@ -119,6 +196,7 @@ class SDProperty(bpy.types.PropertyGroup):
         sid="sampler_name_s",
         name="Sampler",
         items=api.Samplers,
+        version=api.enum_version,
     )
     steps: bpy.props.IntProperty(
         name="Steps",
@@ -181,11 +259,13 @@ class ControlNetPassProperty(bpy.types.PropertyGroup):
         sid="model_s",
         name="Model",
         items=api.CNetModels,
+        version=api.enum_version,
         update=lambda _, ctx: ctx.active_node.init_node_tree()
     )
 
     use_mask: bpy.props.BoolProperty(name="Use Mask")
     srgb: bpy.props.BoolProperty(name="sRGB")
+    format: bpy.props.PointerProperty(type=TransferFormatProperty)
 
     weight: bpy.props.FloatProperty(
         name="Weight",
@@ -234,6 +314,7 @@ class ControlNetPassProperty(bpy.types.PropertyGroup):
         sid="module_s",
         name="Preprocessor",
         items=api.CNetModules,
+        version=api.enum_version,
     )
     pixel_perfect: bpy.props.BoolProperty(name="Pixel Perfect")
     processor_res: bpy.props.IntProperty(
@@ -288,6 +369,138 @@ class TiledVAEProperty(bpy.types.PropertyGroup):
     color_fix: bpy.props.BoolProperty(name="Color Fix")
 
 
+class RenderProfileProperty(bpy.types.PropertyGroup):
+    enabled: bpy.props.BoolProperty(
+        name="Control Render Profile",
+        description="Use faster render settings for the send render, the scene is left unchanged "
+        "apart from Persistent Data",
+    )
+    engine: bpy.props.EnumProperty(
+        name="Engine",
+        items=[
+            ("SCENE", "Scene Engine", "Keep the render engine of the scene"),
+            ("EEVEE", "EEVEE", "Render the inputs with EEVEE"),
+            ("WORKBENCH", "Workbench", "Render the inputs with Workbench"),
+        ],
+    )
+    samples: bpy.props.IntProperty(
+        name="Samples",
+        min=1,
+        default=1,
+    )
+    denoise: bpy.props.BoolProperty(name="Denoise")
+    motion_blur: bpy.props.BoolProperty(name="Motion Blur")
+    simplify: bpy.props.BoolProperty(
+        name="Simplify",
+        description="Skip subdivision, child particles and volumes",
+        default=True,
+    )
+    persistent_data: bpy.props.BoolProperty(
+        name="Persistent Data",
+        description="Turn on persistent data of the scene so cycles keeps its render data "
+        "between sends, it stays on afterwards",
+        default=True,
+    )
+
+    def draw(self, layout):
+        r = layout.row()
+        r.label(text="Control Render:")
+        r.prop(self, "enabled", text="Enabled")
+        if not self.enabled:
+            return
+        box = layout.box().column()
+        x = box.split(factor=0.5, align=True)
+        x.prop(self, "engine", text="")
+        x.prop(self, "samples")
+        x = box.split()
+        x.prop(self, "denoise")
+        x.prop(self, "motion_blur")
+        x = box.split()
+        x.prop(self, "simplify")
+        x.prop(self, "persistent_data")
+
+    @contextlib.contextmanager
+    def apply(self, scene: bpy.types.Scene):
+        """ override the render settings of `scene` while capturing """
+        if not self.enabled:
+            yield
+            return
+        r = scene.render
+        if self.persistent_data and not r.use_persistent_data:
+            # left on, switching it off again would free the data it keeps
+            r.use_persistent_data = True
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(settle_changes())
+            if self.engine == "WORKBENCH":
+                stack.enter_context(utils.override(r, engine="BLENDER_WORKBENCH"))
+            elif self.engine == "EEVEE":
+                # renamed to BLENDER_EEVEE_NEXT in 4.2
+                engines = r.bl_rna.properties["engine"].enum_items.keys()
+                stack.enter_context(utils.override(r, engine=next(
+                    x for x in ("BLENDER_EEVEE_NEXT", "BLENDER_EEVEE") if x in engines
+                )))
+            stack.enter_context(utils.override(
+                r,
+                use_motion_blur=r.use_motion_blur and self.motion_blur,
+            ))
+            if self.simplify:
+                stack.enter_context(utils.override(
+                    r,
+                    use_simplify=True,
+                    simplify_subdivision_render=0,
+                    simplify_child_particles_render=0,
+                    simplify_volumes=0,
+                ))
+
+            if r.engine == "CYCLES":
+                stack.enter_context(utils.override(
+                    scene.cycles,
+                    samples=min(scene.cycles.samples, self.samples),
+                    use_denoising=scene.cycles.use_denoising and self.denoise,
+                ))
+            elif r.engine.startswith("BLENDER_EEVEE"):
+                stack.enter_context(utils.override(
+                    scene.eevee,
+                    taa_render_samples=min(scene.eevee.taa_render_samples, self.samples),
+                ))
+            yield
+
+
+class SDSequenceProperty(bpy.types.PropertyGroup):
+    use_scene_range: bpy.props.BoolProperty(
+        name="Scene Range",
+        default=True,
+    )
+    frame_start: bpy.props.IntProperty(
+        name="Start",
+        min=0,
+        default=1,
+    )
+    frame_end: bpy.props.IntProperty(
+        name="End",
+        min=0,
+        default=250,
+    )
+    filepath: bpy.props.StringProperty(
+        name="Output",
+        subtype="DIR_PATH",
+        default="//sd/",
+    )
+    max_in_flight: bpy.props.IntProperty(
+        name="In Flight",
+        description="Frames submitted to the backends at the same time",
+        min=1,
+        max=32,
+        default=2,
+    )
+    memory_budget: bpy.props.IntProperty(
+        name="Memory Budget (MiB)",
+        description="Limit of captured frame payloads waiting for results",
+        min=16,
+        default=512,
+    )
+
+
 class ControlNetPassList(bpy.types.UIList):
     bl_idname = "SD_UL_ControlNetPassList"
 
@@ -390,6 +603,10 @@ class CompositorNodeSend(utils.CustomCompositorNode):
         soft_min=0,
         soft_max=100,
     )
+    progress_text: bpy.props.StringProperty(
+        name="Progress Text",
+        options={"SKIP_SAVE"},
+    )
     sd: bpy.props.PointerProperty(type=SDProperty)
     txt2img: bpy.props.PointerProperty(type=SDTXT2IMGProperty)
     img2img: bpy.props.PointerProperty(type=SDIMG2IMGProperty)
@@ -408,6 +625,35 @@ class CompositorNodeSend(utils.CustomCompositorNode):
         type=ControlNetPassProperty,
     )
     tiled_vae: bpy.props.PointerProperty(type=TiledVAEProperty)
+    render_profile: bpy.props.PointerProperty(type=RenderProfileProperty)
+    sequence: bpy.props.PointerProperty(type=SDSequenceProperty)
+    live_preview: bpy.props.BoolProperty(
+        name="Live Preview",
+        description="Show the in-progress image in SDOutput_preview",
+    )
+    preview_interval: bpy.props.FloatProperty(
+        name="Interval",
+        description="Seconds between preview updates",
+        subtype="TIME_ABSOLUTE",
+        min=0.2,
+        default=1.0,
+    )
+    render_resolution: bpy.props.EnumProperty(
+        name="Render Size",
+        description="Resolution of the render the inputs are captured from",
+        items=[
+            ("SCENE", "Scene", "Render at the scene resolution"),
+            ("GENERATION", "Generation", "Render at the generation width and height"),
+            ("PERCENTAGE", "Percentage",
+             "Lower the resolution percentage until the render just covers the generation size"),
+        ],
+    )
+    use_cache: bpy.props.BoolProperty(
+        name="Reuse Results",
+        description="Load the results of an identical earlier request with a fixed seed "
+        "from the result cache instead of generating again",
+        default=True,
+    )
     active_control_net_pass_index: bpy.props.IntProperty()
 
     def draw_buttons_ext(self, context, layout):
@@ -422,6 +668,7 @@ class CompositorNodeSend(utils.CustomCompositorNode):
         box = r.box().column()
         if self.ty == "IMAGE":
             box.prop(self.img2img, "resize_mode")
+            self.img2img.format.draw(box, codecs=True)
             box.prop(self.img2img, "use_inpaint")
             if self.img2img.use_inpaint:
                 box = box.box().column()
@@ -445,6 +692,7 @@ class CompositorNodeSend(utils.CustomCompositorNode):
         x = r.split(factor=0.5, align=True)
         x.prop(self.sd, "width")
         x.prop(self.sd, "height")
+        r.prop(self, "render_resolution", text="")
 
         r.prop(self.sd, "sampler_name", text="")
         r.prop(self.sd, "denoising_strength")
@@ -495,6 +743,7 @@ class CompositorNodeSend(utils.CustomCompositorNode):
             x.prop(control_net, "srgb")
             x.prop(control_net, "use_mask")
             x.prop(control_net, "lowvram")
+            control_net.format.draw(layout)
 
             col = layout.column(align=True)
 
@@ -544,12 +793,39 @@ class CompositorNodeSend(utils.CustomCompositorNode):
             if self.tiled_vae.fast_encoder:
                 c.prop(self.tiled_vae, "color_fix")
 
+        layout.separator()
+        self.render_profile.draw(layout)
+
+        r = layout.row(align=True)
+        r.prop(self, "use_cache", toggle=True)
+        r.prop(self, "live_preview", toggle=True)
+        if self.live_preview:
+            r.prop(self, "preview_interval")
+
+        layout.separator()
+        layout.label(text="Sequence:")
+        box = layout.box().column()
+        box.prop(self.sequence, "filepath", text="")
+        r = box.row(align=True)
+        r.prop(self.sequence, "use_scene_range", toggle=True)
+        if not self.sequence.use_scene_range:
+            r.prop(self.sequence, "frame_start")
+            r.prop(self.sequence, "frame_end")
+        x = box.split(factor=0.5, align=True)
+        x.prop(self.sequence, "max_in_flight")
+        x.prop(self.sequence, "memory_budget", text="MiB")
+
     def draw_buttons(self, context, layout):
         if self.progress >= 0:
             layout.enabled = False
             layout.prop(self, "progress", slider=True)
+            if self.progress_text:
+                layout.label(text=self.progress_text)
         else:
-            SendToSD.ui(self, layout)
+            r = layout.row(align=True)
+            SendToSD.ui(self, r)
+            SendSequenceToSD.ui(self, r, text="", icon="RENDER_ANIMATION")
+            r.operator(SendAllToSD.bl_idname, text="", icon="NODETREE")
 
     def init_node_tree(self, **k):
         inputs = []
@@ -561,101 +837,911 @@ class CompositorNodeSend(utils.CustomCompositorNode):
         )
         super().init_node_tree(
             inputs=inputs,
-            outputs=[],
+            outputs=[
+                ('NodeSocketColor', "Capture")
+            ],
             **k,
         )
         self.width = 256
 
 
+def upstream_nodes(tree: bpy.types.NodeTree, *nodes: bpy.types.Node):
+    """ yields (tree, node) for everything feeding the inputs of `nodes`, through node groups """
+    seen = set()
+    stack = [(tree, ln.from_node) for node in nodes for s in node.inputs for ln in s.links]
+    while stack:
+        tree, node = stack.pop()
+        if (tree.name, node.name) in seen:
+            continue
+        seen.add((tree.name, node.name))
+        yield tree, node
+        stack.extend((tree, ln.from_node) for s in node.inputs for ln in s.links)
+        if group := getattr(node, "node_tree", None):
+            stack.extend(
+                (group, x) for x in group.nodes
+                if x.bl_idname == "NodeGroupOutput"
+            )
+
+
+# never muted while sending, the outputs are needed for the render itself
+_scope_keep = {
+    "CompositorNodeComposite", "CompositorNodeViewer",
+    "NodeFrame", "NodeReroute", "NodeGroupInput", "NodeGroupOutput",
+}
+
+
+@contextlib.contextmanager
+def render_scope(scene: bpy.types.Scene, nodes: list[CompositorNodeSend], *, keep=()):
+    """
+    disable the view layers and mute the compositor nodes `nodes` do not
+    depend on, so the render only computes what is sent
+
+    the top-level nodes named in `keep` are left running as well
+    """
+    tree = scene.node_tree
+    upstream = list(upstream_nodes(tree, *nodes))
+    keep = {*keep, *(x.name for x in nodes), *(x.name for t, x in upstream if t == tree)}
+    layers = {
+        x.layer for _, x in upstream
+        if x.bl_idname == "CompositorNodeRLayers" and (x.scene or scene) == scene
+    }
+
+    with contextlib.ExitStack() as stack:
+        used = [x for x in scene.view_layers if x.use]
+        # something has to be rendered even if only images are sent
+        needed = [x for x in used if x.name in layers] or used[:1]
+        for x in used:
+            if x not in needed:
+                stack.enter_context(utils.override(x, use=False))
+        for x in tree.nodes:
+            if x.name not in keep and x.bl_idname not in _scope_keep:
+                stack.enter_context(utils.override(x, mute=True))
+        yield
+
+
+def render_openpose(tree: bpy.types.NodeTree, nodes: list[CompositorNodeSend]):
+    """ render the openpose nodes `nodes` depend on """
+    for _, x in upstream_nodes(tree, *nodes):
+        if x.bl_idname == nodes_pose.CompositorNodeOpenPose.bl_idname:
+            x.render(bpy.context)
+
+
+def render_size(scene: bpy.types.Scene) -> tuple[int, int]:
+    r = scene.render
+    return (
+        r.resolution_x * r.resolution_percentage // 100,
+        r.resolution_y * r.resolution_percentage // 100,
+    )
+
+
+def render_resolution(scene: bpy.types.Scene, node: CompositorNodeSend) -> dict:
+    """ render settings to override for the node's render size mode """
+    w, h = node.sd.width, node.sd.height
+    if node.render_resolution == "GENERATION":
+        return {"resolution_x": w, "resolution_y": h, "resolution_percentage": 100}
+    if node.render_resolution == "PERCENTAGE":
+        r = scene.render
+        p = math.ceil(100 * max(w / r.resolution_x, h / r.resolution_y))
+        return {"resolution_percentage": max(1, min(p, 100))}
+    return {}
+
+
+@contextlib.contextmanager
+def view_socket(tree: bpy.types.NodeTree, socket: bpy.types.NodeSocket):
+    """
+    temporarily feed every viewer with `socket`,
+    so whichever of them is the active output shows it
+    """
+    viewers = [x for x in tree.nodes if x.bl_idname == "CompositorNodeViewer"]
+    created = None
+    if not viewers:
+        created = tree.nodes.new("CompositorNodeViewer")
+        viewers = [created]
+    prev = [
+        (x, x.inputs[0].links[0].from_socket if x.inputs[0].is_linked else None)
+        for x in viewers
+    ]
+    for x in viewers:
+        tree.links.new(socket, x.inputs[0])
+    try:
+        yield
+    finally:
+        for x, s in prev:
+            if s:
+                tree.links.new(s, x.inputs[0])
+            else:
+                for ln in x.inputs[0].links:
+                    tree.links.remove(ln)
+        if created:
+            tree.nodes.remove(created)
+
+
+def read_viewer() -> numpy.ndarray:
+    """ pixels of the viewer image as (height, width, 4), bottom row first """
+    img = next(x for x in bpy.data.images if x.type == 'COMPOSITING')
+    w, h = img.size
+    buf = numpy.empty(w * h * 4, dtype=numpy.float32)
+    img.pixels.foreach_get(buf)
+    return buf.reshape(h, w, 4)
+
+
+def capture_slots(node: CompositorNodeSend) -> list[tuple]:
+    """ `(name, input index, conversion, format, fit)` of every input the node sends """
+    slots = []
+    idx = 0
+
+    if node.ty == "IMAGE":
+        f = node.img2img.format
+        slots.append(("Scene Color", idx, "SRGB", f.snapshot(codecs=True), f.fit))
+        if node.img2img.use_inpaint:
+            slots.append(("Scene Color-M", idx, "MASK", f.snapshot() | {
+                "bits": 8,
+                "color_mode": "GRAY",
+            }, f.fit))
+        idx += 1
+
+    for i, x in enumerate(node.control_net_passes):
+        name = f"ControlNet-{i}-{x.model}"
+        slots.append((name, idx, "SRGB" if x.srgb else None, x.format.snapshot(), x.format.fit))
+        if x.use_mask:
+            slots.append((f"{name}-M", idx, "MASK", x.format.snapshot() | {
+                "bits": 8,
+            }, x.format.fit))
+        idx += 1
+
+    return slots
+
+
+def update_capture_graph(node: CompositorNodeSend, slots: list[tuple], canvas: bpy.types.Image):
+    """
+    convert and stack the inputs onto `canvas` inside the group,
+    the nodes are kept between sends and only rebuilt when the slots change
+    """
+    tree = node.node_tree
+    layout = repr([(i, conversion) for _, i, conversion, _, _ in slots])
+    if tree.get("sd_capture") == layout and (atlas := tree.nodes.get("Canvas")):
+        if atlas.image != canvas:
+            atlas.image = canvas
+        return
+
+    tree.nodes.clear()
+    if "Capture" not in tree.outputs:
+        tree.outputs.new('NodeSocketColor', "Capture")
+
+    input = tree.nodes.new("NodeGroupInput")
+    output = tree.nodes.new("NodeGroupOutput")
+
+    def to_srgb(i):
+        cs = tree.nodes.new(
+            "CompositorNodeConvertColorSpace"
+        )
+        cs.to_color_space = "sRGB"
+        tree.links.new(i, cs.inputs[0])
+        return cs.outputs[0]
+
+    def to_mask(i):
+        sep = tree.nodes.new(
+            "CompositorNodeSeparateColor"
+        )
+        inv = tree.nodes.new("CompositorNodeInvert")
+        tree.links.new(i, sep.inputs[0])
+        tree.links.new(sep.outputs[-1], inv.inputs[-1])
+        return inv.outputs[0]
+
+    atlas = tree.nodes.new("CompositorNodeImage")
+    atlas.name = "Canvas"
+    atlas.image = canvas
+    atlas = atlas.outputs[0]
+    for k, (_, i, conversion, _, _) in enumerate(slots):
+        socket = input.outputs[i]
+        if conversion == "SRGB":
+            socket = to_srgb(socket)
+        elif conversion == "MASK":
+            socket = to_mask(socket)
+        scale = tree.nodes.new("CompositorNodeScale")
+        scale.name = f"Scale {k}"  # row size set per send by `render_atlas`
+        scale.space = "ABSOLUTE"
+        tfm = tree.nodes.new("CompositorNodeTranslate")
+        tfm.name = f"Translate {k}"  # offset set per send by `render_atlas`
+        add = tree.nodes.new("CompositorNodeMixRGB")
+        add.blend_type = "ADD"
+        tree.links.new(socket, scale.inputs[0])
+        tree.links.new(scale.outputs[0], tfm.inputs[0])
+        tree.links.new(atlas, add.inputs[1])
+        tree.links.new(tfm.outputs[0], add.inputs[2])
+        atlas = add.outputs[0]
+    tree.links.new(atlas, output.inputs["Capture"])
+    tree["sd_capture"] = layout
+
+
+def capture(context, node: CompositorNodeSend) -> dict[str, tuple]:
+    """
+    render the scene and return the raw inputs of the node by name,
+    as `(pixels, format, fit)` to be encoded with `encode_inputs`
+    """
+    return capture_all(context, [node])[0]
+
+
+def capture_all(context, nodes: list[CompositorNodeSend], main: CompositorNodeSend = None) -> list[dict]:
+    """
+    `capture` several nodes with a single render,
+    the render size and profile are the ones of `main`
+
+    all inputs are stacked into one atlas in the compositor and
+    read back from the viewer, so nothing touches the disk
+    """
+    main = main or nodes[0]
+    built = [capture_slots(x) for x in nodes]
+    if not any(built):
+        return [{} for _ in nodes]
+
+    scene = context.scene
+    with utils.override(scene.render, **render_resolution(scene, main)), \
+            main.render_profile.apply(scene):
+        return render_atlas(context, nodes, built)
+
+
+def render_atlas(context, nodes: list[CompositorNodeSend], built: list[list]) -> list[dict]:
+    scene = context.scene
+    top = scene.node_tree
+
+    # rows only need to cover the size the inputs are fitted to, twice that
+    # so `codec.fit` still averages the last step, unless one is sent unfitted
+    w, h = render_size(scene)
+    if all(x[4] for slots in built for x in slots):
+        s = min(1, 2 * max(
+            max(node.sd.width / w, node.sd.height / h)
+            for node, slots in zip(nodes, built) if slots
+        ))
+        w, h = max(1, round(w * s)), max(1, round(h * s))
+
+    # inputs are centered on the canvas before translating,
+    # pad the canvas so the centering offset stays a whole pixel
+    n = sum(len(slots) for slots in built)
+    canvas_h = n * h + (n - 1) * h % 2
+    center = (canvas_h - h) // 2
+    canvas = bpy.data.images.get("._SDCapture") or bpy.data.images.new(
+        "._SDCapture", w, canvas_h, float_buffer=True
+    )
+    if tuple(canvas.size) != (w, canvas_h):
+        canvas.generated_width = w
+        canvas.generated_height = canvas_h
+
+    # every node stacks its inputs at its own rows of the canvas
+    k = 0
+    outputs = []
+    for node, slots in zip(nodes, built):
+        if not slots:
+            continue
+        update_capture_graph(node, slots, canvas)
+        for i in range(len(slots)):
+            scale = node.node_tree.nodes[f"Scale {i}"].inputs
+            if (scale["X"].default_value, scale["Y"].default_value) != (w, h):
+                scale["X"].default_value = w
+                scale["Y"].default_value = h
+            y = node.node_tree.nodes[f"Translate {i}"].inputs["Y"]
+            if y.default_value != (k + i) * h - center:
+                y.default_value = (k + i) * h - center
+        k += len(slots)
+        outputs.append(node.outputs["Capture"])
+
+    # before the temporary nodes below, it may raise
+    render_openpose(top, nodes)
+
+    # then the nodes are summed, they are black outside of their rows
+    socket = outputs[0]
+    summed = []
+    for x in outputs[1:]:
+        add = top.nodes.new("CompositorNodeMixRGB")
+        add.blend_type = "ADD"
+        top.links.new(socket, add.inputs[1])
+        top.links.new(x, add.inputs[2])
+        socket = add.outputs[0]
+        summed.append(add)
+
+    try:
+        # the sums are downstream of the nodes, they would be muted otherwise
+        with view_socket(top, socket), render_scope(scene, nodes, keep=[x.name for x in summed]):
+            bpy.ops.render.render()
+        pixels = read_viewer()
+        if pixels.shape[:2] != (canvas_h, w):
+            raise RuntimeError(
+                f"capture is {pixels.shape[1]}x{pixels.shape[0]}, expected {w}x{canvas_h}"
+            )
+        pixels = numpy.ascontiguousarray(pixels[..., :3])  # alpha is never sent
+    finally:
+        for x in summed:
+            top.nodes.remove(x)
+
+    # views into the atlas, no copies until encoding
+    results = []
+    k = 0
+    for slots in built:
+        results.append({
+            name: (pixels[(k + i) * h:(k + i + 1) * h][::-1], fmt, fit)
+            for i, (name, _, _, fmt, fit) in enumerate(slots)
+        })
+        k += len(slots)
+    return results
+
+
+# bumped by every depsgraph update the render inputs may depend on
+_change_token = 0
+_settling = False
+
+# (scene, node, frame) -> (signature, captured), least recently used first
+_captures: collections.OrderedDict[tuple, tuple[tuple, dict]] = collections.OrderedDict()
+
+# properties that only affect how a node is drawn
+_ui_props = {
+    "rna_type", "name", "label", "location", "width", "width_hidden", "height",
+    "dimensions", "select", "hide", "color", "use_custom_color", "parent",
+    "show_options", "show_preview", "show_texture", "progress", "progress_text",
+}
+
+
+@bpy.app.handlers.persistent
+def count_changes(scene, depsgraph):
+    global _change_token
+    if _settling:
+        return
+    for u in depsgraph.updates:
+        id = u.id.original
+        # scene and compositor edits are covered by `render_signature`,
+        # the images are the ones written while sending, results that feed
+        # back into a node are told apart by `rna_id`
+        if isinstance(id, bpy.types.Scene):
+            continue
+        if isinstance(id, bpy.types.NodeTree) and id.bl_idname == "CompositorNodeTree":
+            continue
+        if isinstance(id, bpy.types.Image) and (
+            id.type != 'IMAGE' or id.name.startswith(("._", "SDOutput_"))
+        ):
+            continue
+        _change_token += 1
+        return
+
+
+@contextlib.contextmanager
+def settle_changes():
+    """
+    what the send tags itself, e.g. the objects toggling simplify touches,
+    is evaluated before leaving and not counted as a change of the render inputs
+    """
+    global _settling
+    _settling = True
+    try:
+        yield
+        bpy.context.evaluated_depsgraph_get()
+    finally:
+        _settling = False
+
+
+@bpy.app.handlers.persistent
+def clear_captures(*_):
+    _captures.clear()
+
+
+def rna_id(v: bpy.types.ID):
+    # results are replaced by new images of the same name, see `import_image`
+    if isinstance(v, bpy.types.Image):
+        return v.name, v.as_pointer()
+    return v.name
+
+
+def rna_values(o, seen: set = None) -> list:
+    """
+    plain property values of a struct, recursing into nested structs
+    like color ramps and curve mappings, ids are recorded by `rna_id`
+    """
+    seen = set() if seen is None else seen
+    seen.add(o.as_pointer())
+
+    def value(v):
+        if v is None:
+            return None
+        if isinstance(v, bpy.types.ID):
+            return rna_id(v)
+        if isinstance(v, bpy.types.Depsgraph) or v.as_pointer() in seen:
+            return None
+        return rna_values(v, seen)
+
+    values = []
+    for p in o.bl_rna.properties:
+        k = p.identifier
+        if k in _ui_props:
+            continue
+        if p.type == 'COLLECTION':
+            # sockets and links of nodes are covered by `upstream_signature`
+            if not isinstance(o, bpy.types.Node):
+                values.append((k, [value(x) for x in getattr(o, k)]))
+            continue
+        v = getattr(o, k)
+        if p.type == 'POINTER':
+            values.append((k, value(v)))
+            continue
+        if getattr(p, "is_array", False):
+            v = tuple(v)
+        values.append((k, v))
+    return values
+
+
+def upstream_signature(tree: bpy.types.NodeTree, node: bpy.types.Node) -> list:
+    """ settings and links of everything that feeds the inputs of `node` """
+    def inputs(node):
+        for s in node.inputs:
+            if s.is_linked:
+                for ln in s.links:
+                    out.append((s.identifier, ln.from_node.name, ln.from_socket.identifier))
+            elif hasattr(s, "default_value"):
+                v = s.default_value
+                out.append((s.identifier, v if isinstance(v, (int, float, str)) else tuple(v)))
+
+    out = []
+    inputs(node)
+    for tree, x in upstream_nodes(tree, node):
+        out.append((tree.name, x.bl_idname, x.name, rna_values(x)))
+        inputs(x)
+    return out
+
+
+def render_signature(context, node: CompositorNodeSend, main: CompositorNodeSend) -> tuple:
+    """ the state a capture depends on that `_change_token` does not track """
+    scene = context.scene
+    img2img = node.img2img
+    return (
+        _change_token,
+        scene.frame_current,
+        scene.camera and scene.camera.name,
+        render_size(scene),
+        rna_values(scene.render),
+        [rna_values(x) for x in (
+            getattr(scene, "cycles", None), scene.eevee, scene.display,
+            scene.view_settings, scene.display_settings,
+        ) if x],
+        [(x.name, rna_values(x)) for x in scene.view_layers],
+        upstream_signature(scene.node_tree, node),
+        render_resolution(scene, main),
+        rna_values(main.render_profile),
+        node.ty,
+        (node.sd.width, node.sd.height),  # rows are sized to fit them
+        img2img.use_inpaint,
+        img2img.format.snapshot(codecs=True),
+        img2img.format.fit,
+        [
+            (x.model, x.srgb, x.use_mask, x.format.snapshot(), x.format.fit)
+            for x in node.control_net_passes
+        ],
+    )
+
+
+def capture_cached(context, node: CompositorNodeSend) -> dict[str, tuple]:
+    return capture_all_cached(context, [node])[0]
+
+
+def capture_all_cached(
+    context, nodes: list[CompositorNodeSend], main: CompositorNodeSend = None,
+) -> list[dict]:
+    """
+    `capture_all`, reusing the pixels of an earlier send of the same frame
+    while nothing they depend on has changed, so editing only the
+    generation parameters skips the render
+    """
+    main = main or nodes[0]
+    limit = preferences.get(context=context).capture_cache_size * 1024 * 1024
+    if not limit:
+        return capture_all(context, nodes, main)
+
+    scene = context.scene
+    keys = [(scene.name, x.id_data.name, x.name, scene.frame_current) for x in nodes]
+    sigs = [render_signature(context, x, main) for x in nodes]
+    results = [None] * len(nodes)
+    missing = []
+    for i, (key, sig) in enumerate(zip(keys, sigs)):
+        if (entry := _captures.get(key)) and entry[0] == sig:
+            _captures.move_to_end(key)
+            results[i] = dict(entry[1])  # callers may clear their copy
+        else:
+            missing.append(i)
+    if not missing:
+        return results
+
+    captured = capture_all(context, [nodes[i] for i in missing], main)
+    for i, x in zip(missing, captured):
+        _captures[keys[i]] = sigs[i], x
+        results[i] = dict(x)
+
+    def nbytes(captured):
+        # the inputs are views into one atlas
+        bases = {}
+        for pixels, _, _ in captured.values():
+            while isinstance(pixels.base, numpy.ndarray):
+                pixels = pixels.base
+            bases[id(pixels)] = pixels.nbytes
+        return sum(bases.values())
+
+    total = sum(nbytes(x[1]) for x in _captures.values())
+    while total > limit and len(_captures) > len(missing):
+        _, (_, old) = _captures.popitem(last=False)
+        total -= nbytes(old)
+    return results
+
+
+def encode_inputs(captured: dict[str, tuple], width: int, height: int) -> dict[str, bytes]:
+    """ encode captured inputs in parallel, safe to call off the main thread """
+    def encode(item):
+        pixels, fmt, fit = item
+        if fit:
+            pixels = codec.fit(pixels, width, height)
+        return codec.encode(pixels, **fmt)
+
+    with concurrent.futures.ThreadPoolExecutor() as e:
+        return dict(zip(captured, e.map(encode, captured.values())))
+
+
+class Input:
+    """ placeholder for an encoded input in a request """
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+def resolve_request(req, inputs: dict, *, wrap=api.Base64):
+    """ replace every `Input` in the request with its data, streamed as base64 """
+    if isinstance(req, Input):
+        return wrap(inputs[req.name])
+    if isinstance(req, dict):
+        return {k: resolve_request(v, inputs, wrap=wrap) for k, v in req.items()}
+    if isinstance(req, list):
+        return [resolve_request(x, inputs, wrap=wrap) for x in req]
+    return req
+
+
+def fingerprint(url: str, req: dict, inputs: dict[str, bytes], backends: list[str]) -> str:
+    """
+    result cache key of a request, the images are identified by their hashes,
+    None if the request uses a random seed or the loaded checkpoints are unknown
+
+    asks the backends for their checkpoint, call it in the task
+    """
+    if int(req["seed"]) == -1:
+        return None
+    if req.get("subseed_strength") and int(req["subseed"]) == -1:
+        return None
+    if (models := api.loaded_models(backends)) is None:
+        return None
+    hashes = {k: hashlib.sha256(v).hexdigest() for k, v in inputs.items()}
+    return cache.key({
+        "url": url,
+        "backends": backends,
+        "models": models,
+        "request": resolve_request(req, hashes, wrap=str),
+    })
+
+
+def build_request(node: CompositorNodeSend) -> tuple[str, dict]:
+    """
+    returns the endpoint and the request body,
+    with the images left as `Input` placeholders
+    """
+    b64 = Input
+
+    sd: SDProperty = node.sd
+    req = {
+        "denoising_strength": sd.denoising_strength,
+        "prompt": sd.prompt,
+        "seed": sd.seed,
+        "sampler_name": sd.sampler_name,
+        "batch_size": sd.batch_size,
+        "n_iter": sd.n_iter,
+        "steps": sd.steps,
+        "cfg_scale": sd.cfg_scale,
+        "width": sd.width,
+        "height": sd.height,
+        "negative_prompt": sd.negative_prompt,
+        "alwayson_scripts": {}
+    }
+    if sd.seed_extras:
+        req.update({
+            "subseed": sd.subseed,
+            "subseed_strength": sd.subseed_strength,
+            "seed_resize_from_h": sd.seed_resize_from_h,
+            "seed_resize_from_w": sd.seed_resize_from_w,
+        })
+    cnet_list: list[ControlNetPassProperty] = node.control_net_passes
+    if cnet_list:
+        cnet_req_list = []
+        for i, cnet in enumerate(cnet_list):
+            name = f"ControlNet-{i}-{cnet.model}"
+            cnet_req = {
+                "input_image": b64(name),
+                "model": cnet.model,
+                "module": "none",
+                "weight": cnet.weight,
+                "resize_mode": int(cnet.resize_mode),
+                "control_mode": int(cnet.control_mode),
+                "lowvram": cnet.lowvram,
+                "guidance_start": cnet.guidance_start,
+                "guidance_end": cnet.guidance_end,
+            }
+            if cnet.use_mask:
+                cnet_req.update({
+                    "mask": b64(f"{name}-M"),
+                })
+            if cnet.module != "none":
+                cnet_req.update({
+                    "module": cnet.module,
+                    "pixel_perfect": cnet.pixel_perfect,
+                    "processor_res": cnet.processor_res,
+                    "threshold_a": cnet.threshold_a,
+                    "threshold_b": cnet.threshold_b,
+                })
+            cnet_req_list.append(cnet_req)
+
+        req["alwayson_scripts"].update({
+            "controlnet": {
+                "args": cnet_req_list
+            }
+        })
+    if node.tiled_vae.enabled:
+        req["alwayson_scripts"].update({
+            "Tiled VAE": {
+                "args": [
+                    True,
+                    node.tiled_vae.encoder_tile_size,
+                    node.tiled_vae.decoder_tile_size,
+                    node.tiled_vae.vae_to_gpu,
+                    node.tiled_vae.fast_decoder,
+                    node.tiled_vae.fast_encoder,
+                    node.tiled_vae.color_fix,
+                ],
+            },
+        })
+    if node.ty == "IMAGE":
+        img2img: SDIMG2IMGProperty = node.img2img
+        req.update({
+            "init_images": [b64("Scene Color")],
+            "resize_mode": int(img2img.resize_mode),
+        })
+        if img2img.use_inpaint:
+            req.update({
+                "mask": b64("Scene Color-M"),
+                "mask_blur": img2img.mask_blur,
+                "inpainting_fill": int(img2img.inpainting_fill),
+                "inpaint_full_res": img2img.inpaint_full_res,
+            })
+            if img2img.inpaint_full_res:
+                req.update({
+                    "inpaint_full_res_padding": img2img.inpaint_full_res_padding,
+                })
+        url = "/sdapi/v1/img2img"
+    else:
+        txt2img: SDTXT2IMGProperty = node.txt2img
+        if txt2img.enable_hr:
+            req.update({
+                "enable_hr": txt2img.enable_hr,
+                "hr_scale": txt2img.hr_scale,
+                "hr_resize_x": txt2img.hr_resize_x,
+                "hr_resize_y": txt2img.hr_resize_y,
+                "hr_upscaler": txt2img.hr_upscaler,
+                "hr_second_pass_steps": txt2img.hr_second_pass_steps,
+            })
+        url = "/sdapi/v1/txt2img"
+    return url, req
+
+
+def is_rgba8(data: bytes) -> bool:
+    """ whether the result can be kept as is, checked in the task """
+    return (info := codec.png_info(data)) is not None and info[2:] == (8, 6)
+
+
+def import_image(name: str, data: bytes, rgba8: bool) -> bpy.types.Image:
+    """ load a result from memory, blender decodes the packed bytes itself """
+    image = bpy.data.images.new(f"{name}__tmp", 1, 1)
+    image.pack(data=data, data_len=len(data))
+    image.source = 'FILE'
+
+    if not rgba8:  # convert results to rgba8
+        w, h = image.size
+        buf = numpy.empty(w * h * 4, dtype=numpy.float32)
+        image.pixels.foreach_get(buf)
+        bpy.data.images.remove(image)
+        image = bpy.data.images.new(
+            name=f"{name}__tmp",
+            width=w,
+            height=h,
+            alpha=True,
+            float_buffer=False,
+        )
+        image.pixels.foreach_set(buf)
+        image.pack()
+
+    if old_image := bpy.data.images.get(name):
+        old_image.user_remap(image)
+        bpy.data.images.remove(old_image)
+    image.name = name
+    return image
+
+
+def apply_info(info: dict, count: int, prefix="SDOutput"):
+    for i in range(min(count, len(info["infotexts"]))):
+        if not (image := bpy.data.images.get(f"{prefix}_{i}")):
+            continue
+        image["sd_info"] = {
+            "text": info["infotexts"][i],
+            "prompt": info["all_prompts"][i],
+            "negative_prompt": info["all_negative_prompts"][i],
+            "seed": str(info["all_seeds"][i]),
+            "subseed": str(info["all_subseeds"][i]),
+
+            "batch_size": info["batch_size"],
+            "cfg_scale": info["cfg_scale"],
+            "clip_skip": info["clip_skip"],
+            "denoising_strength": info["denoising_strength"],
+            "width": info["width"],
+            "height": info["height"],
+            "sampler_name": info["sampler_name"],
+            "sd_model_hash": info["sd_model_hash"],
+        }
+
+
+def show_preview(data: bytes):
+    """
+    decode the in-progress image in blender, from memory like `import_image`,
+    into the single preview image, reallocated only on resize
+    """
+    tmp = bpy.data.images.new("SDOutput_preview__tmp", 1, 1)
+    tmp.pack(data=data, data_len=len(data))
+    tmp.source = 'FILE'
+    w, h = tmp.size
+    pixels = numpy.empty(w * h * 4, dtype=numpy.float32)
+    if len(pixels):
+        tmp.pixels.foreach_get(pixels)
+    bpy.data.images.remove(tmp)
+    if not len(pixels):
+        return  # not an image blender can read
+
+    image = bpy.data.images.get("SDOutput_preview")
+    if not image:
+        image = bpy.data.images.new(
+            "SDOutput_preview", w, h, alpha=True, float_buffer=False
+        )
+    elif tuple(image.size) != (w, h):
+        image.scale(w, h)
+    image.pixels.foreach_set(pixels)
+    image.update()
+    for area in bpy.context.screen.areas:
+        if area.type == 'IMAGE_EDITOR':
+            area.tag_redraw()
+
+
+def remove_stale_outputs(count: int, prefix="SDOutput"):
+    for image in [
+        x for x in bpy.data.images
+        if re.match(rf"^{re.escape(prefix)}_[0-9]*$", x.name)
+        and int(x.name.split("_")[-1]) >= count
+    ]:
+        bpy.data.images.remove(image)
+
+
+class Request:
+    """
+    the generation of one node, prepared on the main thread,
+    `run` in a task and `import_pending` back on the main thread
+    """
+
+    def __init__(self, context, node: CompositorNodeSend, captured: dict, *, prefix="SDOutput"):
+        # only blender state is read here, everything else runs in the task
+        self.captured = captured
+        self.url, self.req = build_request(node)
+        self.size = node.sd.width, node.sd.height
+        prefs = preferences.get(context=context)
+        self.limit = prefs.result_cache_size * 1024 * 1024
+        self.cache_root = cache.directory() if node.use_cache and self.limit else None
+        self.backends = prefs.backend_urls()
+        self.prefix = prefix
+        self.job = api.Job()
+        self.images = queue.Queue()
+        self.result = None
+        self.error = None
+        self.count = 0
+
+    def run(self, cancel: threading.Event):
+        try:
+            inputs = encode_inputs(self.captured, *self.size)
+            k = self.cache_root and fingerprint(self.url, self.req, inputs, self.backends)
+            if k and (hit := cache.load(self.cache_root, k)):
+                images, info = hit
+                for i, data in enumerate(images):
+                    self.images.put((i, data, is_rgba8(data)))
+                self.result = {"info": info}
+                return
+
+            received = []  # delivered in order
+
+            def on_image(i, data):
+                received.append(data)
+                self.images.put((i, data, is_rgba8(data)))
+
+            self.result = api.generate(
+                self.url,
+                resolve_request(self.req, inputs),
+                cancel=cancel,
+                on_image=on_image,
+                job=self.job,
+            )
+            if k and self.result and not cancel.is_set():
+                cache.store(self.cache_root, k, received, self.result["info"], self.limit)
+        except (requests.RequestException, api.BackendError, ValueError) as e:
+            self.error = e
+
+    def import_pending(self):
+        """ import the images the task has received so far """
+        while True:
+            try:
+                i, data, rgba8 = self.images.get_nowait()
+            except queue.Empty:
+                return
+            import_image(f"{self.prefix}_{i}", data, rgba8)
+            self.count = max(self.count, i + 1)
+
+    def finish(self):
+        """ after the task is done """
+        self.import_pending()
+        if self.error:
+            raise self.error
+        if self.result:
+            apply_info(json.loads(self.result["info"]), self.count, self.prefix)
+            remove_stale_outputs(self.count, self.prefix)
+
+
+def send_nodes(scene: bpy.types.Scene) -> list[CompositorNodeSend]:
+    if not scene.node_tree:
+        return []
+    return [
+        x for x in scene.node_tree.nodes
+        if x.bl_idname == CompositorNodeSend.bl_idname
+    ]
+
+
 class SendToSD(utils.NodeOperator):
     bl_idname = "sd.send_to_sd"
     bl_label = "Generate"
 
-    def modal(self, context, event):
+    def finish(self, context):
+        self.target.progress = -1
+        self.target.progress_text = ""
+        self.poller.stop.set()
+        context.window_manager.event_timer_remove(self.timer)
         context.area.tag_redraw()
+        self.task.join()
+        self.request.finish()
 
-        def save_results():
-            self.node.progress = -1
-            context.window_manager.event_timer_remove(self.timer)
-            self.task.join()
-            resp = self.resp
-            if resp.status_code == 200:
-                info = json.loads(resp.json()["info"])
-                for i, data in enumerate(resp.json()["images"]):
-                    data = base64.b64decode(data.split(",", 1)[0])
-                    with tempfile.TemporaryDirectory() as dir:
-                        path = os.path.join(dir, str(i))
-                        with io.open(path, mode="w+b") as f:
-                            f.write(data)
-
-                        name = f"SDOutput_{i}"
-                        if image := bpy.data.images.get(name):
-                            image.unpack(method="REMOVE")
-                            image.filepath = path
-                        else:
-                            image = bpy.data.images.load(path)
-                            image.name = name
-
-                        if image.depth != 32:  # convert results to rgba8
-                            old_image = image
-                            old_image.name += "__tmp"
-                            image = bpy.data.images.new(
-                                name=name,
-                                width=image.size[0],
-                                height=image.size[1],
-                                alpha=True,
-                                float_buffer=False,
-                            )
-
-                            # with numpy this is faster
-                            image.pixels = numpy.array(old_image.pixels)
-
-                            old_image.user_remap(image)
-                            bpy.data.images.remove(old_image)
-
-                        if i < len(info["infotexts"]):
-                            sd_info = {
-                                "text": info["infotexts"][i],
-                                "prompt": info["all_prompts"][i],
-                                "negative_prompt": info["all_negative_prompts"][i],
-                                "seed": str(info["all_seeds"][i]),
-                                "subseed": str(info["all_subseeds"][i]),
-
-                                "batch_size": info["batch_size"],
-                                "cfg_scale": info["cfg_scale"],
-                                "clip_skip": info["clip_skip"],
-                                "denoising_strength": info["denoising_strength"],
-                                "width": info["width"],
-                                "height": info["height"],
-                                "sampler_name": info["sampler_name"],
-                                "sd_model_hash": info["sd_model_hash"],
-                            }
-
-                            image["sd_info"] = sd_info
-
-                        image.pack()
-
-                for image in [
-                    x for x in bpy.data.images
-                    if re.match(r"^SDOutput_[0-9]*$", x.name) and int(x.name.split("_")[-1]) > i
-                ]:
-                    bpy.data.images.remove(image)
-
-            else:
-                raise Exception(resp.json())
-
+    def modal(self, context, event):
         if event.type == 'ESC':
-            api.post("/sdapi/v1/interrupt")
-            save_results()
+            self.cancel.set()
+            api.interrupt(self.request.job)
+            self.finish(context)
             return {'CANCELLED'}
 
         if event.type == 'TIMER':
+            self.request.import_pending()
             if not self.task.is_alive():
-                save_results()
+                self.finish(context)
                 return {'FINISHED'}
-            else:
-                resp = api.get("/sdapi/v1/progress").json()
-                self.node.progress = int(resp["progress"] * 100)
+
+            if self.preview is not None:
+                with self.preview_lock:
+                    data, self.preview = self.preview, None
+                show_preview(data)
+
+            _, _, text = self.poller.state
+            progress = int(self.request.job.progress * 100)
+            # only touch the node and redraw when something changed
+            if (progress, text) != (self.target.progress, self.target.progress_text):
+                self.target.progress = progress
+                self.target.progress_text = text
+                context.area.tag_redraw()
 
         return {'RUNNING_MODAL'}
 
@@ -663,225 +1749,263 @@ class SendToSD(utils.NodeOperator):
         if not self.node:
             return {"CANCELLED"}
         node: CompositorNodeSend = self.node
-        with tempfile.TemporaryDirectory() as out_dir:
-            node.node_tree.nodes.clear()
-
-            input = node.node_tree.nodes.new("NodeGroupInput")
-
-            dump = node.node_tree.nodes.new("CompositorNodeOutputFile")
-            dump.base_path = out_dir
-            dump.format.color_depth = "16"
-            dump.format.color_mode = "RGB"
-            dump.format.color_management = "OVERRIDE"
-            dump.format.display_settings.display_device = "None"
-            dump.format.view_settings.view_transform = "Standard"
-            dump.inputs.clear()
-
-            def to_output(i, t):
-                with context.temp_override(node=dump):
-                    bpy.ops.node.output_file_add_socket(file_path=f"{t}@")
-                node.node_tree.links.new(i, dump.inputs[-1])
-
-            def to_srgb(i):
-                cs = node.node_tree.nodes.new(
-                    "CompositorNodeConvertColorSpace"
-                )
-                cs.to_color_space = "sRGB"
-                if i:
-                    node.node_tree.links.new(i, cs.inputs[0])
-                return cs.outputs[0]
-
-            def to_mask(i):
-                sep = node.node_tree.nodes.new(
-                    "CompositorNodeSeparateColor"
-                )
-                inv = node.node_tree.nodes.new("CompositorNodeInvert")
-                node.node_tree.links.new(i, sep.inputs[0])
-                node.node_tree.links.new(sep.outputs[-1], inv.inputs[-1])
-                return inv.outputs[0]
+        self.request = Request(context, node, capture_cached(context, node))
+
+        api.sync_backends()
+        self.target = node  # resolved once for the whole modal run
+        self.target.progress = 0
+        self.preview = None
+        self.preview_lock = threading.Lock()
+
+        def on_preview(data):
+            # only the latest bytes are kept, decoded by blender on the main thread
+            with self.preview_lock:
+                self.preview = data
+
+        self.poller = api.ProgressPoller(
+            on_preview=on_preview if node.live_preview else None,
+            preview_interval=node.preview_interval,
+            job=self.request.job,
+        )
+        self.poller.start()
+        self.cancel = threading.Event()
+        self.task = threading.Thread(target=self.request.run, args=(self.cancel,))
+        self.task.start()
+        self.timer = context.window_manager.event_timer_add(
+            0.25,
+            window=context.window,
+        )
+        context.window_manager.modal_handler_add(self)
 
-            idx = 0
+        return {'RUNNING_MODAL'}
 
-            if node.ty == "IMAGE":
-                srgb = to_srgb(input.outputs[idx])
-                to_output(srgb, "Scene Color")
-                if node.img2img.use_inpaint:
-                    mask = to_mask(input.outputs[idx])
-                    to_output(mask, "Scene Color-M")
-                idx += 1
-
-            for i, x in enumerate(node.control_net_passes):
-                name = f"ControlNet-{i}-{x.model}"
-                if x.srgb:
-                    img = to_srgb(input.outputs[idx])
-                else:
-                    img = input.outputs[idx]
-                to_output(img, name)
-                if x.use_mask:
-                    mask = to_mask(input.outputs[idx])
-                    to_output(mask, f"{name}-M")
-                idx += 1
-
-            def render_all_openpose(tree):
-                for node in tree.nodes:
-                    if node.bl_idname == nodes_pose.CompositorNodeOpenPose.bl_idname:
-                        node.render(bpy.context)
-                    if hasattr(node, "node_tree"):
-                        render_all_openpose(node.node_tree)
-            render_all_openpose(context.scene.node_tree)
 
-            bpy.ops.render.render()
+class SendAllToSD(bpy.types.Operator):
+    bl_idname = "sd.send_all_to_sd"
+    bl_label = "Generate All"
+    bl_description = "Capture every Stable Diffusion node of the compositor with one render " \
+        "and generate them at the same time, into SDOutput_<node>_<index>"
 
-            node.node_tree.nodes.clear()
-
-            inputs = {x.split("@")[0]: x for x in os.listdir(out_dir)}
-
-            sd: SDProperty = node.sd
-            req = {
-                "denoising_strength": sd.denoising_strength,
-                "prompt": sd.prompt,
-                "seed": sd.seed,
-                "sampler_name": sd.sampler_name,
-                "batch_size": sd.batch_size,
-                "n_iter": sd.n_iter,
-                "steps": sd.steps,
-                "cfg_scale": sd.cfg_scale,
-                "width": sd.width,
-                "height": sd.height,
-                "negative_prompt": sd.negative_prompt,
-                "alwayson_scripts": {}
-            }
-            if sd.seed_extras:
-                req.update({
-                    "subseed": sd.subseed,
-                    "subseed_strength": sd.subseed_strength,
-                    "seed_resize_from_h": sd.seed_resize_from_h,
-                    "seed_resize_from_w": sd.seed_resize_from_w,
-                })
-            cnet_list: list[ControlNetPassProperty] = node.control_net_passes
-            if cnet_list:
-                cnet_req_list = []
-                for i, cnet in enumerate(cnet_list):
-                    name = f"ControlNet-{i}-{cnet.model}"
-                    p = os.path.join(
-                        out_dir,
-                        inputs[name],
-                    )
-                    cnet_req = {
-                        "input_image": base64.b64encode(
-                            open(p, 'rb').read()
-                        ).decode('utf-8'),
-                        "model": cnet.model,
-                        "module": "none",
-                        "weight": cnet.weight,
-                        "resize_mode": int(cnet.resize_mode),
-                        "control_mode": int(cnet.control_mode),
-                        "lowvram": cnet.lowvram,
-                        "guidance_start": cnet.guidance_start,
-                        "guidance_end": cnet.guidance_end,
-                    }
-                    if cnet.use_mask:
-                        cnet_req.update({
-                            "mask": base64.b64encode(
-                                open(os.path.join(
-                                    out_dir,
-                                    inputs[f"{name}-M"],
-                                ), 'rb').read()
-                            ).decode('utf-8'),
-                        })
-                    if cnet.module != "none":
-                        cnet_req.update({
-                            "module": cnet.module,
-                            "pixel_perfect": cnet.pixel_perfect,
-                            "processor_res": cnet.processor_res,
-                            "threshold_a": cnet.threshold_a,
-                            "threshold_b": cnet.threshold_b,
-                        })
-                    cnet_req_list.append(cnet_req)
-
-                req["alwayson_scripts"].update({
-                    "controlnet": {
-                        "args": cnet_req_list
-                    }
-                })
-            if node.tiled_vae.enabled:
-                req["alwayson_scripts"].update({
-                    "Tiled VAE": {
-                        "args": [
-                            True,
-                            node.tiled_vae.encoder_tile_size,
-                            node.tiled_vae.decoder_tile_size,
-                            node.tiled_vae.vae_to_gpu,
-                            node.tiled_vae.fast_decoder,
-                            node.tiled_vae.fast_encoder,
-                            node.tiled_vae.color_fix,
-                        ],
-                    },
-                })
-            if node.ty == "IMAGE":
-                img2img: SDIMG2IMGProperty = node.img2img
-                req.update({
-                    "init_images": [
-                        base64.b64encode(
-                            open(os.path.join(
-                                out_dir,
-                                inputs[f"Scene Color"],
-                            ), 'rb').read()
-                        ).decode('utf-8')
-                    ],
-                    "resize_mode": int(img2img.resize_mode),
-                })
-                if img2img.use_inpaint:
-                    req.update({
-                        "mask": base64.b64encode(
-                            open(os.path.join(
-                                out_dir,
-                                inputs[f"Scene Color-M"],
-                            ), 'rb').read()
-                        ).decode('utf-8'),
-                        "mask_blur": img2img.mask_blur,
-                        "inpainting_fill": int(img2img.inpainting_fill),
-                        "inpaint_full_res": img2img.inpaint_full_res,
-                    })
-                    if img2img.inpaint_full_res:
-                        req.update({
-                            "inpaint_full_res_padding": img2img.inpaint_full_res_padding,
-                        })
-                url = "/sdapi/v1/img2img"
-            else:
-                txt2img: SDTXT2IMGProperty = node.txt2img
-                if txt2img.enable_hr:
-                    req.update({
-                        "enable_hr": txt2img.enable_hr,
-                        "hr_scale": txt2img.hr_scale,
-                        "hr_resize_x": txt2img.hr_resize_x,
-                        "hr_resize_y": txt2img.hr_resize_y,
-                        "hr_upscaler": txt2img.hr_upscaler,
-                        "hr_second_pass_steps": txt2img.hr_second_pass_steps,
-                    })
-                url = "/sdapi/v1/txt2img"
-
-            def task(self):
-                self.resp = api.post(url, json=req)
-
-            self.task = threading.Thread(target=task, args=(self,))
-            self.task.start()
-            self.timer = context.window_manager.event_timer_add(
-                0.5,
-                window=context.window,
+    def finish(self, context):
+        for node in self.targets:
+            node.progress = -1
+            node.progress_text = ""
+        self.poller.stop.set()
+        context.window_manager.event_timer_remove(self.timer)
+        context.area.tag_redraw()
+        self.pool.shutdown()
+        errors = []
+        for request in self.requests:
+            try:
+                request.finish()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.cancel.set()
+            for request in self.requests:
+                api.interrupt(request.job)
+            self.finish(context)
+            return {'CANCELLED'}
+
+        if event.type == 'TIMER':
+            for request in self.requests:
+                request.import_pending()
+            if all(x.done() for x in self.tasks):
+                self.finish(context)
+                return {'FINISHED'}
+
+            redraw = False
+            for node, request in zip(self.targets, self.requests):
+                progress = int(request.job.progress * 100)
+                text = "" if request.job.started else "Queued"
+                if (progress, text) != (node.progress, node.progress_text):
+                    node.progress = progress
+                    node.progress_text = text
+                    redraw = True
+            if redraw:
+                context.area.tag_redraw()
+
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        nodes = send_nodes(context.scene)
+        if not nodes:
+            return {"CANCELLED"}
+        # the render size and profile of the active node are used for the shared render
+        active = getattr(context, "active_node", None)
+        main = active if active in nodes else nodes[0]
+        captured = capture_all_cached(context, nodes, main)
+        self.requests = [
+            Request(context, node, x, prefix=f"SDOutput_{node.name}")
+            for node, x in zip(nodes, captured)
+        ]
+
+        api.sync_backends()
+        self.targets = nodes  # resolved once for the whole modal run
+        for node in nodes:
+            node.progress = 0
+        self.poller = api.ProgressPoller()
+        self.poller.start()
+        self.cancel = threading.Event()
+        self.pool = concurrent.futures.ThreadPoolExecutor(len(nodes))
+        self.tasks = [self.pool.submit(x.run, self.cancel) for x in self.requests]
+        self.timer = context.window_manager.event_timer_add(
+            0.25,
+            window=context.window,
+        )
+        context.window_manager.modal_handler_add(self)
+
+        return {'RUNNING_MODAL'}
+
+    @classmethod
+    def poll(cls, context):
+        return bool(context.scene and send_nodes(context.scene))
+
+
+class SendSequenceToSD(utils.NodeOperator):
+    bl_idname = "sd.send_sequence_to_sd"
+    bl_label = "Generate Sequence"
+    bl_description = "Generate every frame of a range into a numbered image sequence"
+
+    def finish(self, context):
+        self.cancel.set()
+        for _, _, job in self.in_flight.values():
+            api.interrupt(job)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        context.window_manager.event_timer_remove(self.timer)
+        context.scene.frame_set(self.frame_restore)
+        self.target.progress = -1
+        self.target.progress_text = ""
+
+    def can_submit(self):
+        if not self.frames or len(self.in_flight) >= self.max_in_flight:
+            return False
+        # always allow one frame so a single large payload cannot stall
+        queued = sum(x[1] for x in self.in_flight.values())
+        return not self.in_flight or queued + self.payload_size <= self.budget
+
+    def submit(self, context):
+        frame = self.frames.pop(0)
+        context.scene.frame_set(frame)
+        captured = capture(context, self.target)  # rendered once, kept out of the capture cache
+        url, req = build_request(self.target)
+        size = self.target.sd.width, self.target.sd.height
+        self.payload_size = sum(x[0].nbytes for x in captured.values())
+
+        single = req["batch_size"] * req["n_iter"] == 1
+        job = api.Job()
+
+        def write(i, data):
+            name = f"{frame:04d}" if single and not i else f"{frame:04d}_{i}"
+            with io.open(os.path.join(self.path, f"{name}.{codec.extension(data)}"), mode="wb") as f:
+                f.write(data)
+
+        def task():
+            inputs = encode_inputs(captured, *size)
+            captured.clear()  # release the raw pixels while waiting
+            api.generate(
+                url,
+                resolve_request(req, inputs),
+                cancel=self.cancel,
+                on_image=write,
+                job=job,
             )
-            context.window_manager.modal_handler_add(self)
+
+        self.in_flight[self.pool.submit(task)] = frame, self.payload_size, job
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.finish(context)
+            return {'CANCELLED'}
+
+        if event.type == 'TIMER':
+            for f in [x for x in self.in_flight if x.done()]:
+                del self.in_flight[f]
+                self.done += 1
+                try:
+                    f.result()
+                except BaseException:
+                    self.finish(context)
+                    raise
+
+            if not self.frames and not self.in_flight:
+                self.finish(context)
+                return {'FINISHED'}
+
+            # one render per tick so the ui still handles events in between
+            if self.can_submit():
+                try:
+                    self.submit(context)
+                except BaseException:
+                    self.finish(context)
+                    raise
+
+            progress = self.done * 100 // self.total
+            if progress != self.target.progress:
+                self.target.progress = progress
+                context.area.tag_redraw()
+
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        if not self.node:
+            return {"CANCELLED"}
+        self.target = self.node  # resolved once for the whole modal run
+        seq: SDSequenceProperty = self.target.sequence
+        if seq.use_scene_range:
+            start, end = context.scene.frame_start, context.scene.frame_end
+        else:
+            start, end = seq.frame_start, seq.frame_end
+        self.frames = list(range(start, end + 1))
+        if not self.frames:
+            return {"CANCELLED"}
+
+        self.path = bpy.path.abspath(seq.filepath)
+        os.makedirs(self.path, exist_ok=True)
+
+        api.sync_backends()
+        self.frame_restore = context.scene.frame_current
+        self.total = len(self.frames)
+        self.done = 0
+        self.max_in_flight = seq.max_in_flight
+        self.budget = seq.memory_budget * 1024 * 1024
+        self.payload_size = 0
+        self.in_flight = {}
+        self.cancel = threading.Event()
+        self.pool = concurrent.futures.ThreadPoolExecutor(self.max_in_flight)
+        self.target.progress = 0
+        self.timer = context.window_manager.event_timer_add(
+            0.1,
+            window=context.window,
+        )
+        context.window_manager.modal_handler_add(self)
 
         return {'RUNNING_MODAL'}
 
 
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(count_changes)
+    bpy.app.handlers.load_post.append(clear_captures)
+
+
+def unregister():
+    bpy.app.handlers.load_post.remove(clear_captures)
+    bpy.app.handlers.depsgraph_update_post.remove(count_changes)
+    _captures.clear()
+
+
 classes = [
+    TransferFormatProperty,
     SDProperty, SDIMG2IMGProperty, SDTXT2IMGProperty,
-    ControlNetPassProperty, TiledVAEProperty,
+    ControlNetPassProperty, TiledVAEProperty, RenderProfileProperty, SDSequenceProperty,
     ControlNetPassList,
     ControlNetPassAdd, ControlNetPassRemove,
     ControlNetPassMoveUp, ControlNetPassMoveDown,
-    CompositorNodeSend, SendToSD
+    CompositorNodeSend, SendToSD, SendAllToSD, SendSequenceToSD,
 ]
 
 
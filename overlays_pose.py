@@ -11,13 +11,18 @@ from . import preferences
 vs = '''
     uniform mat4 tfm;
     uniform vec2 size;
-    uniform vec3 start;
-    uniform vec3 end;
-    uniform float width;
+    uniform float thickness;
 
     in vec2 position;
+    in vec3 start;
+    in vec3 end;
+    in vec3 col;
+    in float width;
+    in float rect;
     out vec2 coord;
     out float z;
+    out vec3 vcol;
+    out float vrect;
 
     vec3 proj(vec3 w) {
         vec4 h = tfm * vec4(w, 1.0f);
@@ -26,6 +31,8 @@ vs = '''
     }
     void main() {
         coord = position - 0.5f;
+        vcol = col;
+        vrect = rect;
 
         vec2 pos = position - 0.5f;
 
@@ -35,7 +42,7 @@ vs = '''
         vec2 t = pt.xy;
 
         if(p != t){
-            pos.y *= width;
+            pos.y *= width * thickness;
             pos.x += 0.5f;
             pos.x *= distance(t, p);
             vec2 direction = normalize(t - p);
@@ -47,7 +54,7 @@ vs = '''
             );
             pos = (vec3(pos, 1.0f) * rot).xy;
         } else {
-            pos *= width;
+            pos *= width * thickness;
         }
         pos += p;
         z = min(pt.z, pp.z);
@@ -57,11 +64,11 @@ vs = '''
 
 fs = '''
     uniform float gamma;
-    uniform vec3 col;
-    uniform int rect;
 
     in vec2 coord;
     in float z;
+    in vec3 vcol;
+    in float vrect;
     out vec4 color;
 
     void main()
@@ -69,18 +76,18 @@ fs = '''
         if(z < 0.0f) {
             discard;
         }
-        color.rgb = col;
+        color.rgb = vcol;
         color.rgb = pow(color.rgb, vec3(gamma));
-        if(rect == 0) color.a = length(coord - vec2(0.0f)) > 0.5f ? 0.0f : 1.0f;
+        if(vrect == 0.0f) color.a = length(coord - vec2(0.0f)) > 0.5f ? 0.0f : 1.0f;
         else color.a = 1.0f;
     }
 '''
 
 shader = gpu.types.GPUShader(vs, fs)
-batch = gpu_extras.batch.batch_for_shader(shader, 'TRIS', {
-    "position": [(1, 1), (0, 1), (0, 0),
-                 (1, 1), (0, 0), (1, 0)]
-})
+quad = numpy.array([
+    (1, 1), (0, 1), (0, 0),
+    (1, 1), (0, 0), (1, 0),
+], dtype=numpy.float32)
 
 
 # from https://github.com/lllyasviel/ControlNet-v1-1-nightly/blob/b9ae087ef56ca786d9a3ee1008f814bb171bb913/annotator/openpose/util.py#L75
@@ -107,10 +114,22 @@ hand_parts_link = [
 ]
 
 
+body_links = numpy.array(parts_link)
+body_colors = numpy.array(parts_color, dtype=numpy.float32) / 255
+body_link_colors = body_colors[:len(parts_link)] * 0.6
+hand_links = numpy.array(hand_parts_link)
+hand_colors = numpy.array([
+    colorsys.hsv_to_rgb(i / float(len(hand_parts_link)), 1.0, 1.0)
+    for i in range(len(hand_parts_link))
+], dtype=numpy.float32)
+hand_size = 21
+
+
 def scene_camera_info():
+    r = bpy.context.scene.render
     size = [
-        bpy.context.scene.render.resolution_x,
-        bpy.context.scene.render.resolution_y
+        r.resolution_x * r.resolution_percentage // 100,
+        r.resolution_y * r.resolution_percentage // 100,
     ]
     mat = bpy.context.scene.camera.calc_matrix_camera(
         depsgraph=bpy.context.evaluated_depsgraph_get(),
@@ -123,6 +142,9 @@ def scene_camera_info():
 
 
 viewport_state = None
+
+# depsgraph updates per (id type, name) of armature objects and their data
+change_counts = collections.Counter()
 viewport_openpose_scene = {
     "bodies": [],
     "faces": [],
@@ -130,113 +152,208 @@ viewport_openpose_scene = {
 }
 
 
+def _rows(a, b, col, width, rect=0) -> numpy.ndarray:
+    n = len(a)
+    return numpy.column_stack([
+        a, b,
+        numpy.broadcast_to(numpy.asarray(col, dtype=numpy.float32), (n, 3)),
+        numpy.full(n, width, dtype=numpy.float32),
+        numpy.full(n, rect, dtype=numpy.float32),
+    ])
+
+
+def _links(points: numpy.ndarray, links: numpy.ndarray, colors: numpy.ndarray, width, rect=0):
+    """ rows for the links whose ends are both bound """
+    a, b = points[links[:, 0]], points[links[:, 1]]
+    ok = numpy.isfinite(a[:, 0]) & numpy.isfinite(b[:, 0])
+    return _rows(a[ok], b[ok], colors[ok], width, rect)
+
+
+def _points(points: numpy.ndarray, colors, width):
+    """ rows for the bound points """
+    ok = numpy.isfinite(points[:, 0])
+    if numpy.ndim(colors) == 2:
+        colors = colors[ok]
+    return _rows(points[ok], points[ok], colors, width)
+
+
+def build_primitives(openpose_scene, ty) -> numpy.ndarray:
+    """
+    one row of (start xyz, end xyz, color rgb, width, rect) per link or point,
+    in drawing order
+    """
+    out = []
+    for body in openpose_scene["bodies"]:
+        out.append(_links(body, body_links, body_link_colors, 8))
+        out.append(_points(body, body_colors, 8))
+
+    if ty == "FULL":
+        for hand in openpose_scene["hands"]:
+            out.append(_links(hand, hand_links, hand_colors, 2, rect=1))
+            out.append(_points(hand, (0, 0, 1), 8))
+
+        for face in openpose_scene["faces"]:
+            out.append(_points(face, (1, 1, 1), 6))
+
+    if not out:
+        return numpy.empty((0, 11), dtype=numpy.float32)
+    return numpy.concatenate(out).astype(numpy.float32)
+
+
+# (openpose scene, type, batch) of the last draw, rebuilt when either changes
+_batch_cache = (None, None, None)
+
+
+def overlay_batch(openpose_scene, ty) -> gpu.types.GPUBatch:
+    """ every link and point as one triangle list, a quad per primitive """
+    global _batch_cache
+    if _batch_cache[0] is openpose_scene and _batch_cache[1] == ty:
+        return _batch_cache[2]
+
+    prims = build_primitives(openpose_scene, ty)
+    batch = None
+    if len(prims):
+        verts = numpy.repeat(prims, len(quad), axis=0)
+        attrs = {
+            "start": verts[:, 0:3],
+            "end": verts[:, 3:6],
+            "col": verts[:, 6:9],
+            "width": verts[:, 9],
+            "rect": verts[:, 10],
+        }
+        batch = gpu_extras.batch.batch_for_shader(shader, 'TRIS', {
+            "position": numpy.tile(quad, (len(prims), 1)),
+            **{k: numpy.ascontiguousarray(v) for k, v in attrs.items()},
+        })
+    _batch_cache = (openpose_scene, ty, batch)
+    return batch
+
+
 def draw_overlay(*, offscreen_scene=None, ty="FULL", thickness=2):
     if not offscreen_scene:
         if not bpy.context.space_data.overlay.show_overlays:
             return
 
+        prefs = preferences.get()
+        ty = prefs.openpose_overlay
+        if ty == "NONE":
+            return
         size = [bpy.context.region.width, bpy.context.region.height]
         mat = bpy.context.region_data.perspective_matrix
-        thickness = preferences.get().openpose_overlay_thickness
-        ty = preferences.get().openpose_overlay
+        thickness = prefs.openpose_overlay_thickness
 
         refresh_viewport_parts()
 
         openpose_scene = viewport_openpose_scene
     else:
+        if ty == "NONE":
+            return
         size, mat = scene_camera_info()
         openpose_scene = offscreen_scene
 
-    def draw_link(a, b, col, *, rect=False, width=8):
-        gpu.state.blend_set("ALPHA")
-        shader.bind()
-        shader.uniform_float("tfm", mat)
-        shader.uniform_float("size", size)
-        shader.uniform_float("start", a)
-        shader.uniform_float("end", b)
-        shader.uniform_float("col", col)
-        shader.uniform_float("width", width * thickness)
-        shader.uniform_int("rect", 1 if rect else 0)
-        shader.uniform_float("gamma", 2.2 if not openpose_scene else 1)
-        batch.draw(shader)
-
-    if ty == "NONE":
-        return
-    for body in openpose_scene["bodies"]:
-        for i, ln in enumerate(parts_link):
-            a, b = [body.get(x) for x in ln]
-            if a and b:
-                draw_link(
-                    a, b,
-                    numpy.array(parts_color[int(i)]) / 255 * 0.6
-                )
-
-        for i, pt in body.items():
-            draw_link(pt, pt, numpy.array(parts_color[int(i)]) / 255)
-
-    if ty == "BODY":
+    if not (batch := overlay_batch(openpose_scene, ty)):
         return
-
-    for hand in openpose_scene["hands"]:
-        for i, ln in enumerate(hand_parts_link):
-            a, b = [hand.get(x) for x in ln]
-            if a and b:
-                draw_link(
-                    a, b,
-                    colorsys.hsv_to_rgb(
-                        i / float(len(hand_parts_link)),
-                        1.0,
-                        1.0
-                    ),
-                    rect=True,
-                    width=2,
-                )
-
-        for i, pt in hand.items():
-            draw_link(pt, pt, [0, 0, 1])
-
-    for face in openpose_scene["faces"]:
-        for pt in face:
-            draw_link(pt, pt, [1, 1, 1], width=6)
-
-
-def collect_body(obj):
-    out = {}
-    for bone, pose in filter(
-        lambda x: x[0].sd_openpose.body_binding,
-        zip(obj.data.edit_bones or obj.data.bones, obj.pose.bones)
-    ):
-        for x in bone.sd_openpose.body_binding:
-            out[x.index] = obj.matrix_world @ pose.head.lerp(
-                pose.tail, x.offset
-            )
-    return out
-
-
-def collect_face(obj):
-    out = []
-    for bone, pose in filter(
-        lambda x: x[0].sd_openpose.face_binding,
-        zip(obj.data.edit_bones or obj.data.bones, obj.pose.bones)
-    ):
-        for x in bone.sd_openpose.face_binding:
-            out.append(obj.matrix_world @ pose.head.lerp(
-                pose.tail, x.offset
-            ))
-    return out
-
-
-def collect_hands(obj):
-    l = collections.defaultdict(dict)
-    for bone, pose in filter(
-        lambda x: x[0].sd_openpose.hand_binding,
-        zip(obj.data.edit_bones or obj.data.bones, obj.pose.bones)
-    ):
-        for x in bone.sd_openpose.hand_binding:
-            l[x.group][x.index] = obj.matrix_world @ pose.head.lerp(
-                pose.tail, x.offset
-            )
-    return l.values()
+    gpu.state.blend_set("ALPHA")
+    shader.bind()
+    shader.uniform_float("tfm", mat)
+    shader.uniform_float("size", size)
+    shader.uniform_float("thickness", thickness)
+    shader.uniform_float("gamma", 2.2 if not openpose_scene else 1)
+    batch.draw(shader)
+
+
+# armature name -> (data change count, bindings), see `compile_bindings`
+_bindings_cache: dict[str, tuple] = {}
+
+
+def compile_bindings(obj: bpy.types.Object) -> dict[str, tuple]:
+    """
+    the bindings of every bone as flat `(bone indices, offsets, targets)` arrays,
+    targets are keypoint indices, hand targets are `group row * hand_size + index`
+
+    only recompiled when the armature data or the number of pose bones changed
+    """
+    count = change_counts["ARMATURE", obj.data.name], len(obj.pose.bones)
+    if (entry := _bindings_cache.get(obj.data.name)) and entry[0] == count:
+        return entry[1]
+
+    body, face, hand = [], [], []
+    groups = {}  # hand group -> row, in order of appearance
+    # the indices are into the pose bones, edit bones may outnumber them
+    for i, (bone, _) in enumerate(zip(obj.data.edit_bones or obj.data.bones, obj.pose.bones)):
+        op = bone.sd_openpose
+        for x in op.body_binding:
+            if 0 <= x.index < len(parts_color):
+                body.append((i, x.offset, x.index))
+        for x in op.face_binding:
+            face.append((i, x.offset, len(face)))
+        for x in op.hand_binding:
+            if 0 <= x.index < hand_size:
+                row = groups.setdefault(x.group, len(groups))
+                hand.append((i, x.offset, row * hand_size + x.index))
+
+    def arrays(rows):
+        rows = numpy.array(rows, dtype=numpy.float64).reshape(-1, 3)
+        return rows[:, 0].astype(numpy.int64), rows[:, 1].astype(numpy.float32), rows[:, 2].astype(numpy.int64)
+
+    bindings = {
+        "body": arrays(body),
+        "face": arrays(face),
+        "hand": arrays(hand),
+        "hand_groups": len(groups),
+    }
+    _bindings_cache[obj.data.name] = count, bindings
+    return bindings
+
+
+def collect_keypoints(obj: bpy.types.Object) -> tuple:
+    """
+    `(body, face, hands)` in world space, body is (len(parts_color), 3),
+    face (n, 3) and hands a list of (hand_size, 3), unbound rows are nan
+    """
+    bindings = compile_bindings(obj)
+    body = numpy.full((len(parts_color), 3), numpy.nan, dtype=numpy.float32)
+    hands = numpy.full((bindings["hand_groups"], hand_size, 3), numpy.nan, dtype=numpy.float32)
+    face = numpy.empty((len(bindings["face"][0]), 3), dtype=numpy.float32)
+    if not any(len(bindings[k][0]) for k in ("body", "face", "hand")):
+        return body, face, list(hands)
+
+    # all pose bones at once, then every binding in one lerp and transform
+    bones = obj.pose.bones
+    heads = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+    tails = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+    bones.foreach_get("head", heads)
+    bones.foreach_get("tail", tails)
+    heads = heads.reshape(-1, 3)
+    tails = tails.reshape(-1, 3)
+    m = numpy.array(obj.matrix_world, dtype=numpy.float32)
+
+    def points(bone, offset):
+        h = heads[bone]
+        p = h + (tails[bone] - h) * offset[:, None]
+        return p @ m[:3, :3].T + m[:3, 3]
+
+    bone, offset, target = bindings["body"]
+    body[target] = points(bone, offset)
+    bone, offset, target = bindings["face"]
+    face[target] = points(bone, offset)
+    bone, offset, target = bindings["hand"]
+    hands.reshape(-1, 3)[target] = points(bone, offset)
+    return body, face, list(hands)
+
+
+# object name -> (change token, frame, (body, face, hands)) of the last collection
+_parts_cache: dict[str, tuple] = {}
+
+
+def collect_object(obj: bpy.types.Object, frame: int) -> tuple:
+    """ keypoints of one armature, reused while it and the frame are unchanged """
+    token = change_token(obj)
+    if (entry := _parts_cache.get(obj.name)) and entry[:2] == (token, frame):
+        return entry[2]
+    parts = collect_keypoints(obj)
+    _parts_cache[obj.name] = token, frame, parts
+    return parts
 
 
 def collect_parts(scene: bpy.types.Scene, view_layer: bpy.types.ViewLayer):
@@ -250,31 +367,84 @@ def collect_parts(scene: bpy.types.Scene, view_layer: bpy.types.ViewLayer):
         x for x in scene.objects
         if x.type == "ARMATURE" and x.visible_get(view_layer=view_layer)
     ):
-        openpose_scene["bodies"].append(collect_body(obj))
-        openpose_scene["faces"].append(collect_face(obj))
-        openpose_scene["hands"].extend(collect_hands(obj))
+        body, face, hands = collect_object(obj, scene.frame_current)
+        openpose_scene["bodies"].append(body)
+        openpose_scene["faces"].append(face)
+        openpose_scene["hands"].extend(hands)
 
     return openpose_scene
 
 
+def same_parts(a: dict, b: dict) -> bool:
+    """ whether two collections hold the same cached keypoints """
+    return all(
+        len(a[k]) == len(b[k]) and all(x is y for x, y in zip(a[k], b[k]))
+        for k in ("bodies", "faces", "hands")
+    )
+
+
+# set by `update_handler`, the viewport collects again on its next draw
+viewport_dirty = True
+
+
+def clear_caches():
+    """ for binding edits the depsgraph does not report """
+    _bindings_cache.clear()
+    _parts_cache.clear()
+
+
 def refresh_viewport_parts(*, force=False):
-    global viewport_openpose_scene, viewport_state
-    current_state = bpy.context.scene, bpy.context.view_layer
-    if (not force) and (viewport_state == current_state):
+    """ `force` also drops the keypoint caches """
+    global viewport_openpose_scene, viewport_state, viewport_dirty
+    if force:
+        clear_caches()
+    current_state = bpy.context.scene, bpy.context.view_layer, bpy.context.scene.frame_current
+    if not (force or viewport_dirty) and viewport_state == current_state:
         return
 
+    viewport_dirty = False
     viewport_state = current_state
-    viewport_openpose_scene = collect_parts(
-        *current_state
-    )
+    parts = collect_parts(*current_state[:2])
+    # keep the old object while nothing moved, so the overlay batch is reused
+    if not same_parts(parts, viewport_openpose_scene):
+        viewport_openpose_scene = parts
+
+    if force:
+        redraw_viewports()
 
+
+def redraw_viewports():
     for x in filter(lambda x: x.type == 'VIEW_3D', bpy.context.screen.areas):
         x.tag_redraw()
 
 
+def change_token(obj: bpy.types.Object) -> tuple:
+    """ changes whenever the transform, pose or bindings of the armature do """
+    return (
+        obj.name,
+        change_counts["OBJECT", obj.name],
+        change_counts["ARMATURE", obj.data.name],
+    )
+
+
 @bpy.app.handlers.persistent
-def update_handler(scene, context):
-    refresh_viewport_parts(force=True)
+def update_handler(scene, depsgraph):
+    global viewport_dirty
+    relevant = False
+    for u in depsgraph.updates:
+        id = u.id.original
+        if isinstance(id, bpy.types.Armature) or (
+            isinstance(id, bpy.types.Object) and id.type == "ARMATURE"
+        ):
+            change_counts[id.id_type, id.name] += 1
+            relevant = True
+        elif isinstance(id, (bpy.types.Scene, bpy.types.Collection)):
+            relevant = True  # visibility or the active view layer may have changed
+    if not relevant:
+        return
+    viewport_dirty = True
+    if preferences.get().openpose_overlay != "NONE":
+        redraw_viewports()
 
 
 def draw_overlay_options(self, context):
@@ -1,5 +1,6 @@
 import bpy
 from . import api
+from . import cache
 from . import utils
 
 
@@ -12,20 +13,145 @@ class ClearCaches(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class ClearResultCache(bpy.types.Operator):
+    bl_idname = f"sd.clear_result_cache"
+    bl_label = f"Clear Result Cache"
+
+    def execute(self, context):
+        cache.clear(cache.directory())
+        return {'FINISHED'}
+
+
+class CheckBackends(bpy.types.Operator):
+    bl_idname = f"sd.check_backends"
+    bl_label = f"Check Backends"
+
+    def execute(self, context):
+        api.sync_backends()
+        return {'FINISHED'}
+
+
+def update_backends(self, context):
+    api.sync_backends()
+
+
+class BackendProperty(bpy.types.PropertyGroup):
+    url: bpy.props.StringProperty(
+        name="URL",
+        update=update_backends,
+    )
+    enabled: bpy.props.BoolProperty(
+        name="Enabled",
+        default=True,
+        update=update_backends,
+    )
+
+
+class BackendList(bpy.types.UIList):
+    bl_idname = "SD_UL_BackendList"
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname):
+        r = layout.row(align=True)
+        r.prop(item, "enabled", text="")
+        r.prop(item, "url", text="", emboss=False)
+        if (b := api.backend(item.url)) and item.enabled:
+            if not b.healthy:
+                r.label(text="Offline", icon="ERROR")
+            elif b.latency is not None:
+                r.label(text=f"{b.latency * 1000:.0f} ms")
+
+
+class BackendAdd(bpy.types.Operator):
+    bl_idname = f"sd.add_backend"
+    bl_label = "Add Backend"
+
+    def execute(self, context):
+        prefs = get(context=context)
+        prefs.backends.add()
+        prefs.active_backend_index = len(prefs.backends) - 1
+        return {'FINISHED'}
+
+
+class BackendRemove(bpy.types.Operator):
+    bl_idname = f"sd.remove_backend"
+    bl_label = "Remove Backend"
+
+    def execute(self, context):
+        prefs = get(context=context)
+        prefs.backends.remove(prefs.active_backend_index)
+        api.sync_backends()
+        return {'FINISHED'}
+
+    @classmethod
+    def poll(cls, context):
+        prefs = get(context=context)
+        return 0 <= prefs.active_backend_index < len(prefs.backends)
+
+
 class Preferences(bpy.types.AddonPreferences):
     bl_idname = __package__
 
+    def update_url(self, context):
+        api.refresh_enum_caches()
+        api.sync_backends()
+
     url: bpy.props.StringProperty(
         name="Stable Diffusion WebUI URL",
-        update=lambda x, y: api.clear_enum_caches()
+        update=update_url,
+    )
+    backends: bpy.props.CollectionProperty(
+        name="Additional Backends",
+        type=BackendProperty,
+    )
+    active_backend_index: bpy.props.IntProperty()
+
+    result_cache_size: bpy.props.IntProperty(
+        name="Result Cache Size (MiB)",
+        description="Disk space for results of fixed seed requests, 0 disables the cache",
+        min=0,
+        default=1024,
+    )
+
+    capture_cache_size: bpy.props.IntProperty(
+        name="Render Cache Size (MiB)",
+        description="Memory for captured render inputs, reused when only "
+        "generation parameters changed, 0 always renders",
+        min=0,
+        default=1024,
     )
 
     openpose_overlay: utils.OpenPoseOverlayTypeProperty()
     openpose_overlay_thickness: utils.OpenPoseOverlayThicknessProperty()
 
+    def backend_urls(self) -> list[str]:
+        """ the main url first, then every enabled additional backend """
+        urls = [self.url, *(x.url for x in self.backends if x.enabled)]
+        return list(dict.fromkeys(x.strip("/") for x in urls if x.strip()))
+
     def draw(self, context):
         layout = self.layout.column()
         layout.prop(self, "url")
+        layout.label(text="Additional Backends:")
+        r = layout.row()
+        r.template_list(
+            BackendList.bl_idname,
+            "",
+            self,
+            "backends",
+            self,
+            "active_backend_index",
+            rows=2,
+        )
+        l = r.column(align=True)
+        l.operator(BackendAdd.bl_idname, icon="ADD", text="")
+        l.operator(BackendRemove.bl_idname, icon="REMOVE", text="")
+        layout.operator(CheckBackends.bl_idname)
+        layout.separator()
+        layout.prop(self, "capture_cache_size")
+        r = layout.row()
+        r.prop(self, "result_cache_size")
+        r.operator(ClearResultCache.bl_idname)
+        layout.separator()
         layout.prop(self, "openpose_overlay")
         layout.prop(self, "openpose_overlay_thickness")
         layout.operator(ClearCaches.bl_idname)
@@ -35,6 +161,18 @@ def get(*, context=bpy.context) -> Preferences:
     return context.preferences.addons[__package__].preferences
 
 
+def _deferred_register():
+    api.sync_backends()
+    api.refresh_enum_caches()
+
+
+def register():
+    # preferences are not available until the addon is fully enabled
+    bpy.app.timers.register(_deferred_register, first_interval=0.1)
+
+
 classes = [
-    ClearCaches, Preferences,
+    ClearCaches, ClearResultCache, CheckBackends,
+    BackendProperty, BackendList, BackendAdd, BackendRemove,
+    Preferences,
 ]
@@ -1,6 +1,7 @@
 import bpy
 import math
 import os
+import contextlib
 
 
 def OpenPoseOverlayTypeProperty(*, name="OpenPose Overlay Type"):
@@ -31,31 +32,47 @@ def EnumStringStoreProperty(**k):
     )
 
 
-def EnumStringProperty(*, sid, **k):
+def EnumStringProperty(*, sid, version=None, **k):
     """
     store enum as value string instead of index
     so inserting entries wont break existing selections
+
+    `version()` has to change whenever the dynamic items do,
+    until then reads reuse the last items without calling back
     """
 
+    # (version, items) of the last callback
+    known = [None, None]
+
     def _items(self) -> list[tuple[str, str, str]]:
         items = k["items"]
         if callable(items):
+            if not version:
+                return items(self, bpy.context)
+            v = version()
+            if known[1] is not None and known[0] == v:
+                return known[1]
             items = items(self, bpy.context)
+            known[:] = v, items
         return items
 
-    def _find(self, o) -> int:
-        return next((
-            i for i, x in enumerate(_items(self))
-            if x[0] == o
-        ), -1)
+    # (items, value -> index), rebuilt only when the items list is replaced
+    # dynamic callbacks have to return the same list object while unchanged
+    index = [None, {}]
+
+    def _find(items, o) -> int:
+        if items is not index[0]:
+            index[:] = items, {x[0]: i for i, x in reversed(list(enumerate(items)))}
+        return index[1].get(o, -1)
 
     def _get(self):
+        items = _items(self)
         if s := self.get(sid):
-            i = _find(self, s)
+            i = _find(items, s)
             if i == -1:
                 return 2147483647
         else:
-            i = _find(self, k.get("default", _items(self)[0][0]))
+            i = _find(items, k["default"]) if "default" in k else 0
 
         assert i >= 0
         return i
@@ -112,6 +129,28 @@ def RoundedIntProperty(*, id, **kwargs):
     )
 
 
+@contextlib.contextmanager
+def override(o, **values):
+    """ temporarily set attributes of `o`, only the ones that differ are touched """
+    prev = {k: getattr(o, k) for k in values if getattr(o, k) != values[k]}
+    try:
+        for k in prev:
+            setattr(o, k, values[k])
+        yield o
+    finally:
+        for k, v in reversed(prev.items()):
+            setattr(o, k, v)
+
+
+def cache_dir(*path: str) -> str:
+    """ per-user cache directory of the addon, created on demand """
+    return bpy.utils.user_resource(
+        'DATAFILES',
+        path=os.path.join(__package__, "cache", *path),
+        create=True,
+    )
+
+
 class CustomNode(bpy.types.NodeCustomGroup):
     cnode_type: str
 